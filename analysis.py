@@ -8,9 +8,33 @@
 ################################################################################
 
 from __future__ import division
+import bisect
+from functools import partial
+import hashlib
+import itertools
+import json
 import math
+import multiprocessing
+import os
+import re
+import sqlite3
+import time
 
 import numpy
+from scipy.stats import norm
+
+import instrument
+
+# The properties sent along with every sentiment request.
+SENTIMENT_PROPERTIES = {
+    'annotators':   'sentiment',
+    'outputFormat': 'json'
+}
+
+# A sentence ends at a run of terminal punctuation, along with any closing
+# quotes or brackets, that is followed by whitespace.
+SENTENCE_END = re.compile(r'[.!?]+[\'")\]]*\s+')
+TOKEN = re.compile(r'\w+|[^\w\s]', re.UNICODE)
 
 # Provide the StanfordCoreNLP object and the text to annotate. A list of scores
 # will be returned. The location of the score corresponds to the sentence in the
@@ -18,29 +42,692 @@ import numpy
 #    1: Positive
 #    0: Neutral
 #   -1: Negative
-# As a bonus, this method will automatically break up the text as needed by
-# number of characters as an optional parameter. For large text, this allows you
-# to not violate the timeout on the StanfordCoreNLP server instance.
-def sentiment(nlp, text, step=None):
+# As a bonus, this method will automatically break up the text into requests of
+# whole sentences so that large text does not violate the timeout on the
+# StanfordCoreNLP server instance. By default the size of the requests adapts to
+# how quickly the server responds. A step can be given to instead fix the
+# number of characters per request, or a SentenceBatcher for full control. If a
+# SentimentCache is given, then only the sentences that are not already in it
+# are sent to the server.
+#
+# The nlp object is the sentiment backend. It is either a client of the server,
+# which has an annotate method like the pycorenlp client, or a backend that
+# scores in process, which has a score_units method like LexiconSentiment.
+def sentiment(nlp, text, step=None, batcher=None, cache=None):
+    return sentiment_many(nlp, [text], step, batcher, cache)[0]
+
+# The same as sentiment, but for a list of texts, and a list of the scores of
+# each text is returned. The requests for all of the texts go through one
+# queue, so a client that pipelines requests, such as a CoreNLPClient, keeps
+# busy across the ends of the texts.
+def sentiment_many(nlp, texts, step=None, batcher=None, cache=None):
+    if batcher is None:
+        batcher = SentenceBatcher(max_chars=step, adaptive=step is None)
+
+    groups = sentiment_unit_groups(nlp, [split_sentences(t) for t in texts],
+                                   batcher, cache)
+    return [[score for scores in group for score in scores] for group in groups]
+
+# Returns the configuration of a sentiment backend, which tells apart the
+# scores of different backends, such as in a SentimentCache. A backend that has
+# no config of its own is a StanfordCoreNLP client with SENTIMENT_PROPERTIES.
+def backend_config(nlp):
+    return getattr(nlp, 'config', SENTIMENT_PROPERTIES)
+
+# Scores a list of units of text, such as sentences or the content of Lines,
+# which are packed whole into requests by the batcher. A list is returned with
+# a list of scores for each unit, in the same order as the units. The server
+# may split a unit into several sentences, and a sentence is counted for the
+# unit it starts in.
+def sentiment_units(nlp, units, batcher=None, cache=None):
+    return sentiment_unit_groups(nlp, [units], batcher, cache)[0]
+
+# The same as sentiment_units, but for a list of lists of units. The units of
+# different lists are never batched together, but all of the batches share one
+# queue of requests.
+def sentiment_unit_groups(nlp, groups, batcher=None, cache=None):
+    with instrument.timer('sentiment'):
+        return _sentiment_unit_groups(nlp, groups, batcher, cache)
+
+def _sentiment_unit_groups(nlp, groups, batcher, cache):
+    if batcher is None:
+        batcher = SentenceBatcher()
+
+    # Only the units that are not in the cache are sent to the server, so
+    # todo holds the positions of those units for each group.
     results = []
-    if step is None or step <= 0:
-        step = len(text)
+    todo = []
+    for units in groups:
+        if cache is None:
+            results.append([[] for _ in units])
+            todo.append(range(len(units)))
+        else:
+            cached = cache.get_with_runs([(0, i, unit) for i, unit in enumerate(units)])
+            results.append([scores or [] for scores in cached])
+            todo.append([i for i, scores in enumerate(cached) if scores is None])
 
-    i = 0
-    while i < len(text):
-        # TODO. Go to nearest sentence marker
-        temp = text[i : i + step]
-        result = nlp.annotate(temp, properties={
-            'annotators':   'sentiment',
-            'outputFormat': 'json'
-        })
+    instrument.count('sentiment.units', sum(len(units) for units in groups))
+    instrument.count('sentiment.units_to_score', sum(len(positions) for positions in todo))
+
+    # A backend that scores in process takes the units directly, and there is
+    # no server to batch requests for.
+    if hasattr(nlp, 'score_units'):
+        for g, positions in enumerate(todo):
+            units = [groups[g][i] for i in positions]
+            scores = nlp.score_units(units)
+            for i, unit_scores in zip(positions, scores):
+                results[g][i] = unit_scores
+
+            if cache is not None:
+                cache.put_many(zip(units, scores))
 
-        results += map(_get_scalar_sentiment, result['sentences'])
+        return results
 
-        i += step
+    # Each request is a batch of units from a single group, and the batches of
+    # a group are only built when the queue has room for them, so they are
+    # sized by the latest latencies.
+    def batch_requests():
+        for g, positions in enumerate(todo):
+            units = groups[g]
+            for batch in batcher.batches([units[i] for i in positions]):
+                batch = [positions[i] for i in batch]
+                yield g, batch, ' '.join(units[i] for i in batch)
+
+    for (g, batch, text), result, latency in _annotate_all(nlp, batch_requests()):
+        units = [groups[g][i] for i in batch]
+        scores = _response_scores(batcher, units, text, result, latency, cache)
+        for i, unit_scores in zip(batch, scores):
+            results[g][i] = unit_scores
 
     return results
 
+# Scores units of text that arrive as a stream, for when the units are not all
+# known up front. The units are given as (group, unit) pairs, and as with
+# sentiment_unit_groups, the units of different groups are never batched
+# together. Yields (group, index, scores) for each unit as soon as its scores
+# are known, where index is the position of the unit among the units of its
+# group. So the scores of a group come out of order.
+#
+# Units are only taken from the stream as the requests need them, so a lazily
+# built stream is only read as quickly as the server keeps up with it. The
+# units that are found in the cache go through the client's queue of requests
+# a chunk at a time, without going to the server, so that they are held back
+# by it the same as the rest. At most a batch of units per group, and the
+# chunks and requests in the queue, are held waiting.
+def sentiment_stream(nlp, units, batcher=None, cache=None):
+    return instrument.timed_stream('sentiment', partial(_sentiment_stream, nlp,
+                                                        batcher=batcher, cache=cache),
+                                   units)
+
+def _sentiment_stream(nlp, units, batcher, cache):
+    if batcher is None:
+        batcher = SentenceBatcher()
+
+    def numbered():
+        counts = {}
+        for group, unit in units:
+            i = counts.get(group, 0)
+            counts[group] = i + 1
+            yield group, i, unit
+
+    # Returns the (group, index, unit) of the units of the chunk that are not
+    # in the cache, and the (group, index, scores) of those that are. Unless
+    # the chunk is the last, the units at the end of each group that are not
+    # in the cache are held back and returned as well, since they may start a
+    # run that goes on in the next chunk, and are looked up again with it.
+    def lookup(chunk, last):
+        if cache is None:
+            todo = chunk
+            hits = []
+            held = []
+        else:
+            results = cache.get_with_runs(chunk)
+
+            holding = set()
+            tails = {}
+            if not last:
+                for k in reversed(range(len(chunk))):
+                    group = chunk[k][0]
+                    if tails.get(group, 0) is None:
+                        continue
+                    if results[k] is None and tails.get(group, 0) < SentimentCache.MAX_HELD_UNITS:
+                        holding.add(k)
+                        tails[group] = tails.get(group, 0) + 1
+                    else:
+                        tails[group] = None
+            cache.misses -= len(holding)
+
+            todo = []
+            hits = []
+            held = []
+            for k, (item, scores) in enumerate(zip(chunk, results)):
+                if k in holding:
+                    held.append(item)
+                elif scores is None:
+                    todo.append(item)
+                else:
+                    hits.append((item[0], item[1], scores))
+
+        instrument.count('sentiment.units', len(chunk) - len(held))
+        instrument.count('sentiment.units_to_score', len(todo))
+        return todo, hits, held
+
+    def lookups():
+        held = []
+        for chunk in _stream_chunks(numbered(), SentimentCache.QUERY_CHUNK_SIZE):
+            todo, hits, held = lookup(held + chunk, False)
+            yield todo, hits
+        if held:
+            todo, hits, _ = lookup(held, True)
+            yield todo, hits
+
+    if hasattr(nlp, 'score_units'):
+        for todo, hits in lookups():
+            scores = nlp.score_units([unit for _, _, unit in todo])
+            if cache is not None:
+                cache.put_many((unit, unit_scores)
+                               for (_, _, unit), unit_scores in zip(todo, scores))
+
+            for hit in hits:
+                yield hit
+            for (group, i, _), unit_scores in zip(todo, scores):
+                yield group, i, unit_scores
+        return
+
+    # A chunk of cache hits is sent along as a request without any text, with
+    # the hits in place of a batch.
+    def batch_requests():
+        builders = {}
+        for todo, hits in lookups():
+            if hits:
+                yield None, hits, None
+
+            for group, i, unit in todo:
+                if group not in builders:
+                    builders[group] = BatchBuilder(batcher)
+
+                batch = builders[group].add((i, unit), unit)
+                if batch:
+                    yield group, batch, ' '.join(unit for _, unit in batch)
+
+        for group in sorted(builders):
+            batch = builders[group].finish()
+            if batch:
+                yield group, batch, ' '.join(unit for _, unit in batch)
+
+    for (group, batch, text), result, latency in _annotate_all(nlp, batch_requests()):
+        if text is None:
+            for hit in batch:
+                yield hit
+            continue
+
+        scores = _response_scores(batcher, [unit for _, unit in batch], text,
+                                  result, latency, cache)
+        for (i, _), unit_scores in zip(batch, scores):
+            yield group, i, unit_scores
+
+# Yields lists of up to size items of the iterable.
+def _stream_chunks(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+# Sends each request to the server, through the pipeline of the client if it
+# has one, and yields (request, result, latency) in the order of the requests.
+# The text of a request is its last item, and a request whose text is None is
+# passed along without going to the server.
+def _annotate_all(nlp, requests):
+    def annotate(request):
+        if request[-1] is None:
+            return request, None, 0
+
+        start = time.time()
+        result = nlp.annotate(request[-1], properties=SENTIMENT_PROPERTIES)
+        return request, result, time.time() - start
+
+    if hasattr(nlp, 'pipeline'):
+        return nlp.pipeline(annotate, requests)
+
+    return itertools.imap(annotate, requests)
+
+# Returns a list of the scores of each of the units of a request from the
+# server's result for it, and records the response with the batcher. The units
+# are the ones that were joined with spaces into the text of the request.
+def _response_scores(batcher, units, text, result, latency, cache):
+    batcher.record(len(text), latency)
+    instrument.count('sentiment.requests')
+    instrument.count('sentiment.chars', len(text))
+    instrument.observe('sentiment.latency', latency)
+
+    scores = [[] for _ in units]
+    assigned, runs = _assign_sentences(result['sentences'], units)
+    for i, score in assigned:
+        scores[i].append(score)
+
+    # A unit that shares a sentence with its neighbours only has those
+    # scores in that context, so it is not cached on its own, but along with
+    # the run of its neighbours that it was scored with.
+    if cache is not None:
+        spanned = set(i for first, last in runs for i in range(first, last + 1))
+        cache.put_many((units[i], scores[i])
+                       for i in range(len(units)) if i not in spanned)
+        cache.put_runs((units[first:last + 1], scores[first:last + 1])
+                       for first, last in runs)
+
+    return scores
+
+# Returns (unit position, score) for each sentence in the server result, where
+# the unit position is the index into units of the unit the sentence starts in.
+# The units are the ones that were joined with spaces into the request. Also
+# returned is a list of the runs of units that sentences run over, as the
+# positions (first, last) of their units. Sentences that share a unit are in
+# the same run.
+def _assign_sentences(sentences, units):
+    starts = []
+    offset = 0
+    for unit in units:
+        starts.append(offset)
+        offset += _char_len(unit) + 1
+
+    assigned = []
+    runs = []
+    i = 0
+    for sentence in sentences:
+        tokens = sentence.get('tokens')
+        if tokens:
+            i = max(bisect.bisect_right(starts, tokens[0]['characterOffsetBegin']) - 1, 0)
+            last = bisect.bisect_right(starts, tokens[-1]['characterOffsetBegin']) - 1
+            if last > i:
+                if runs and i <= runs[-1][1]:
+                    runs[-1][1] = max(runs[-1][1], last)
+                else:
+                    runs.append([i, last])
+        assigned.append((i, _get_scalar_sentiment(sentence)))
+
+    return assigned, [tuple(run) for run in runs]
+
+# A persistent cache of the sentiment scores of units of text, kept in a
+# SQLite database. The key of a unit is the hash of its text, with runs of
+# whitespace collapsed, along with the annotator configuration, so the scores
+# of different configurations never mix. At most max_entries units are kept,
+# and when there are more the least recently used ones are evicted. The number
+# of lookups that were found and that were not are counted in hits and misses.
+#
+# The units that the server scored together, since one of its sentences ran
+# over all of them, are kept as a run under the hash of all of their texts, so
+# they are found again when they come up next to each other once more.
+class SentimentCache(object):
+    DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'shakespeare',
+                                'sentiment.sqlite')
+    DEFAULT_MAX_ENTRIES = 1000000
+
+    # SQLite limits the number of parameters in one statement.
+    QUERY_CHUNK_SIZE = 500
+
+    # The most units of a group at the end of a chunk of a stream that are
+    # held back to be looked up with the next chunk, in case they are in a run.
+    MAX_HELD_UNITS = 64
+
+    def __init__(self, path=DEFAULT_PATH, max_entries=DEFAULT_MAX_ENTRIES,
+                 config=SENTIMENT_PROPERTIES):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.max_entries = max_entries
+        self.config = json.dumps(config, sort_keys=True)
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS entries '
+                          '(key TEXT PRIMARY KEY, scores TEXT NOT NULL, used INTEGER NOT NULL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS entries_used ON entries (used)')
+
+        # Recency is tracked with a counter rather than the time, so it keeps
+        # increasing across runs no matter the clock.
+        self._clock, self._count = self.conn.execute(
+            'SELECT COALESCE(MAX(used), 0), COUNT(*) FROM entries').fetchone()
+
+    def key(self, text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+
+        h = hashlib.sha1(self.config)
+        h.update('\0')
+        h.update(' '.join(text.split()))
+        return h.hexdigest()
+
+    # The key of a run of units that were scored together, because a sentence
+    # of the server ran over more than one of them.
+    def run_key(self, texts):
+        h = hashlib.sha1(self.config)
+        h.update('\0run')
+        for text in texts:
+            if isinstance(text, unicode):
+                text = text.encode('utf-8')
+            h.update('\0')
+            h.update(' '.join(text.split()))
+        return h.hexdigest()
+
+    # Returns a list with the cached scores of each of the texts, or None for
+    # those that are not cached.
+    def get_many(self, texts):
+        keys = [self.key(t) for t in texts]
+        found = self._find(keys)
+
+        results = [found.get(key) for key in keys]
+        hits = sum(1 for r in results if r is not None)
+        self.hits += hits
+        self.misses += len(results) - hits
+
+        return results
+
+    # The same as get_many, but the units that were stored as a run with
+    # put_runs are found too. The units are given as (block, index, text),
+    # where the units of a block with consecutive indexes are the ones that
+    # would be scored next to each other, such as the sentences of one group.
+    # A run is only found where all of its units are next to each other in
+    # the same way, so in the same context, and it takes the place of the
+    # scores that its units have on their own.
+    def get_with_runs(self, units):
+        results = self.get_many([text for _, _, text in units])
+
+        # The units are split into blocks of consecutive units, where runs are
+        # looked for if a unit of the block is not cached on its own. A unit
+        # that is cached on its own can still be in a run, since its text may
+        # have been scored alone somewhere else, so the units of a run are
+        # taken from the run even if they were found.
+        blocks = []
+        last = None
+        for block, i, k in sorted((block, i, k) for k, (block, i, _) in enumerate(units)):
+            if last == (block, i - 1):
+                blocks[-1].append(k)
+            else:
+                blocks.append([k])
+            last = (block, i)
+        blocks = [ks for ks in blocks if any(results[k] is None for k in ks)]
+
+        # The lengths of the runs that start with each unit are kept under the
+        # run key of the unit alone, so only the runs that were stored are
+        # looked for.
+        starts = {}
+        for ks in blocks:
+            for start, k in enumerate(ks):
+                starts.setdefault(self.run_key([units[k][2]]), []).append((ks, start))
+
+        candidates = {}
+        for key, lengths in self._find(starts.keys()).items():
+            for ks, start in starts[key]:
+                for length in lengths:
+                    if length <= len(ks) - start:
+                        run = ks[start:start + length]
+                        candidates.setdefault(self.run_key([units[k][2] for k in run]), []).append(run)
+
+        # The longest run found is taken at each unit that one starts from.
+        longest = {}
+        for key, scores in self._find(candidates.keys()).items():
+            for run in candidates[key]:
+                if len(run) > len(longest.get(run[0], ((), None))[0]):
+                    longest[run[0]] = (run, scores)
+
+        hits = 0
+        for ks in blocks:
+            start = 0
+            while start < len(ks):
+                if ks[start] not in longest:
+                    start += 1
+                    continue
+
+                run, scores = longest[ks[start]]
+                for k, unit_scores in zip(run, scores):
+                    if results[k] is None:
+                        hits += 1
+                    results[k] = unit_scores
+                start += len(run)
+
+        self.hits += hits
+        self.misses -= hits
+
+        return results
+
+    # Returns a dict of the scores of each of the keys that is cached, and
+    # marks those as just used.
+    def _find(self, keys):
+        found = {}
+        for chunk in _chunks(list(set(keys)), SentimentCache.QUERY_CHUNK_SIZE):
+            marks = ','.join('?' * len(chunk))
+            rows = self.conn.execute('SELECT key, scores FROM entries WHERE key IN ({})'.format(marks), chunk)
+            found.update((key, json.loads(scores)) for key, scores in rows)
+
+        if found:
+            self._clock += 1
+            for chunk in _chunks(found.keys(), SentimentCache.QUERY_CHUNK_SIZE):
+                marks = ','.join('?' * len(chunk))
+                self.conn.execute('UPDATE entries SET used = ? WHERE key IN ({})'.format(marks),
+                                  [self._clock] + chunk)
+            self.conn.commit()
+
+        return found
+
+    # Stores the scores of each (text, scores) pair, then evicts the least
+    # recently used entries if there are too many.
+    def put_many(self, items):
+        self._clock += 1
+        self._put_rows([(self.key(text), json.dumps(scores), self._clock)
+                        for text, scores in items])
+
+    # Stores the scores of each (texts, scores) pair, where texts is a run of
+    # units that were scored together and scores has the scores of each of
+    # them. The length of the run is added to those stored for its first unit.
+    def put_runs(self, runs):
+        runs = list(runs)
+        if not runs:
+            return
+
+        starts = {}
+        for texts, _ in runs:
+            starts.setdefault(self.run_key(texts[:1]), set()).add(len(texts))
+
+        found = self._find(starts.keys())
+        for key, lengths in found.items():
+            starts[key].update(lengths)
+        self.conn.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key in found])
+        self._count -= len(found)
+
+        self._clock += 1
+        rows = [(self.run_key(texts), json.dumps(scores), self._clock)
+                for texts, scores in runs]
+        rows.extend((key, json.dumps(sorted(lengths)), self._clock)
+                    for key, lengths in starts.items())
+        self._put_rows(rows)
+
+    def _put_rows(self, rows):
+        if not rows:
+            return
+
+        before = self.conn.total_changes
+        self.conn.executemany('INSERT OR IGNORE INTO entries VALUES (?, ?, ?)', rows)
+        self._count += self.conn.total_changes - before
+
+        if self._count > self.max_entries:
+            self.conn.execute('DELETE FROM entries WHERE key IN '
+                              '(SELECT key FROM entries ORDER BY used LIMIT ?)',
+                              (self._count - self.max_entries,))
+            self._count = self.max_entries
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+# The server counts offsets in characters rather than bytes.
+def _char_len(s):
+    if isinstance(s, unicode):
+        return len(s)
+
+    return len(s.decode('utf-8', 'replace'))
+
+# Splits text into sentences at SENTENCE_END. Surrounding whitespace is removed
+# and empty sentences are dropped.
+def split_sentences(text):
+    sentences = []
+    start = 0
+    for m in SENTENCE_END.finditer(text):
+        sentence = text[start:m.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = m.end()
+
+    sentence = text[start:].strip()
+    if sentence:
+        sentences.append(sentence)
+
+    return sentences
+
+# Splits text into sentences in the same way as split_sentences, where the
+# text is fed in pieces that are joined with spaces. The sentences that the
+# pieces so far are known to end are returned as each piece is fed, and the
+# rest when the splitter is closed.
+class SentenceSplitter(object):
+    def __init__(self):
+        self.text = None
+
+    def feed(self, piece):
+        text = piece if self.text is None else self.text + ' ' + piece
+
+        # A sentence end that reaches the end of the text may still run on
+        # into the next piece, so it is left for later.
+        sentences = []
+        start = 0
+        for m in SENTENCE_END.finditer(text):
+            if m.end() == len(text):
+                break
+
+            sentence = text[start:m.end()].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = m.end()
+
+        self.text = text[start:]
+        return sentences
+
+    def close(self):
+        sentences = split_sentences(self.text) if self.text is not None else []
+        self.text = None
+
+        return sentences
+
+# Packs units of text into batches for requests to the server. A batch holds as
+# many whole units as fit within max_chars characters and, if given, max_tokens
+# tokens. A unit that is too big on its own is sent as its own batch rather
+# than being split.
+#
+# If adaptive, then the batch size follows the observed speed of the server, as
+# reported through record. The size is set so that a request is expected to
+# take target_latency seconds, which should be comfortably below the server
+# timeout, while staying between min_chars and limit_chars.
+class SentenceBatcher(object):
+    DEFAULT_MAX_CHARS = 17000
+    DEFAULT_TARGET_LATENCY = 10.0
+    DEFAULT_MIN_CHARS = 1000
+    DEFAULT_LIMIT_CHARS = 100000
+
+    # How much weight the newest observation gets in the running estimate of
+    # the server speed.
+    SMOOTHING = 0.5
+
+    def __init__(self, max_chars=None, max_tokens=None, adaptive=True,
+                 target_latency=DEFAULT_TARGET_LATENCY,
+                 min_chars=DEFAULT_MIN_CHARS, limit_chars=DEFAULT_LIMIT_CHARS):
+        self.max_chars = max_chars or SentenceBatcher.DEFAULT_MAX_CHARS
+        self.max_tokens = max_tokens
+        self.adaptive = adaptive
+        self.target_latency = target_latency
+        self.min_chars = min_chars
+        self.limit_chars = limit_chars
+
+        self.chars_per_second = None
+
+    # Yields lists of positions into units, one list per batch. The limits are
+    # checked as each batch is built, so a record made between batches applies
+    # to the very next one.
+    def batches(self, units):
+        builder = BatchBuilder(self)
+        for i, unit in enumerate(units):
+            batch = builder.add(i, unit)
+            if batch:
+                yield batch
+
+        batch = builder.finish()
+        if batch:
+            yield batch
+
+    # Records that a request of the given number of characters took latency
+    # seconds, and resizes the batches if adaptive.
+    def record(self, chars, latency):
+        if not self.adaptive or latency <= 0:
+            return
+
+        speed = chars / latency
+        if self.chars_per_second is None:
+            self.chars_per_second = speed
+        else:
+            self.chars_per_second = (SentenceBatcher.SMOOTHING * speed +
+                                     (1 - SentenceBatcher.SMOOTHING) * self.chars_per_second)
+
+        size = int(self.chars_per_second * self.target_latency)
+        self.max_chars = min(max(size, self.min_chars), self.limit_chars)
+
+# Builds the batches of a SentenceBatcher a unit at a time, for when the units
+# arrive one by one rather than as a list. Each unit is added along with an
+# item, and the batches are lists of the items.
+class BatchBuilder(object):
+    def __init__(self, batcher):
+        self.batcher = batcher
+        self.batch = []
+        self.chars = 0
+        self.tokens = 0
+
+    # Adds the item of the unit to the batch. If the unit does not fit, then
+    # the full batch is returned and the unit starts the next one. Otherwise
+    # None is returned.
+    def add(self, item, unit):
+        batcher = self.batcher
+        unit_chars = len(unit) + (1 if self.batch else 0)
+        unit_tokens = len(TOKEN.findall(unit)) if batcher.max_tokens else 0
+
+        full = None
+        if self.batch and (self.chars + unit_chars > batcher.max_chars or
+                           (batcher.max_tokens and
+                            self.tokens + unit_tokens > batcher.max_tokens)):
+            full = self.batch
+            self.batch = []
+            self.chars = 0
+            self.tokens = 0
+            unit_chars = len(unit)
+
+        self.batch.append(item)
+        self.chars += unit_chars
+        self.tokens += unit_tokens
+
+        return full
+
+    # Returns the last batch, or None if it is empty.
+    def finish(self):
+        batch = self.batch
+        self.batch = []
+        self.chars = 0
+        self.tokens = 0
+
+        return batch or None
+
 # Internal method to return a 1, 0, or -1 based the result from the Stanford
 # Core NLP server. The sentence object is a json object that comes from each
 # item in the sentences field in the server result.
@@ -54,6 +741,14 @@ def _get_scalar_sentiment(sentence):
     else:
         return 0
 
+# The vectorized bootstrap resamples this many values at a time at most, so
+# that memory stays bounded no matter how many samples are asked for.
+BOOTSTRAP_CHUNK_SIZE = 1 << 20
+
+# The kinds of confidence interval that bootstrap can estimate.
+PERCENTILE_CI = 'percentile'
+BCA_CI = 'bca'
+
 # Runs an estimated confidence interval and SE from the given values. For any
 # type of objects a confidence interval will be returned as the first two
 # elements. ~2.5% of samples had a value less than the first element, and ~2.5%
@@ -72,26 +767,174 @@ def _get_scalar_sentiment(sentence):
 # the variance of the percentage of values greater than 0 in the entire objects
 # list.
 #
+# If the objects are numbers and the statistic can be computed by numpy, then
+# vectorized should be set. In that case sample_value is called as
+# sample_value(samples, axis=1) on a 2D array with one sample per row, and must
+# return one value per row, like sample_mean or proportion_positive below. The
+# samples are then drawn and evaluated in chunks of rows rather than one at a
+# time. Both forms draw the same samples from the same random state.
+#
+# For large numbers of samples the work can be split into workers parts that
+# run in separate processes, either in the given multiprocessing pool or in one
+# made for the call. Each part draws from its own random stream, and the
+# streams are all derived from seed, so the result only depends on the seed and
+# the number of workers, not on the pool or on scheduling. Without a seed the
+# streams are derived from numpy's global random state, and with one worker and
+# no seed the global random state is used directly as it always has been. When
+# running in other processes sample_value has to be picklable, so it must be a
+# module level function rather than a lambda.
+#
+# The interval is the 100 * (1 - alpha)% interval. The default ci method reads
+# it straight off the percentiles of the bootstrapped values. The BCA_CI method
+# corrects those percentiles for the bias and skew of the bootstrapped values,
+# which costs one evaluation of sample_value per object for the jackknife.
+#
 # The return tuple is structured as follows:
 #   (min_ci, max_ci, se)
 # Note that these values are bootstraped estimates.
-def bootstrap(objects, sample_value, num_samples, sample_size=-1):
+def bootstrap(objects, sample_value, num_samples, sample_size=-1,
+              vectorized=False, seed=None, workers=1, pool=None,
+              ci=PERCENTILE_CI, alpha=0.05):
+    with instrument.timer('bootstrap'):
+        instrument.count('bootstrap.replicates', num_samples)
+        return _bootstrap(objects, sample_value, num_samples, sample_size,
+                          vectorized, seed, workers, pool, ci, alpha)
+
+def _bootstrap(objects, sample_value, num_samples, sample_size, vectorized,
+               seed, workers, pool, ci, alpha):
     if sample_size < 0:
         sample_size = len(objects)
-    samples = numpy.random.choice(objects, size=(num_samples, sample_size),
-                                  replace=True).tolist()
 
-    values = map(sample_value, samples)
-    values.sort()
+    if workers == 1 and seed is None:
+        values = _sample_values((objects, sample_value, num_samples,
+                                 sample_size, vectorized, None))
+    else:
+        rng = numpy.random if seed is None else numpy.random.RandomState(seed)
+        seeds = rng.randint(0, 2 ** 31 - 1, size=workers)
+        parts = [(objects, sample_value, count, sample_size, vectorized, part_seed)
+                 for count, part_seed in zip(_split(num_samples, workers), seeds)]
+
+        if workers == 1:
+            values = _sample_values(parts[0])
+        elif pool is not None:
+            values = numpy.concatenate(pool.map(_sample_values, parts))
+        else:
+            own_pool = multiprocessing.Pool(workers)
+            try:
+                values = numpy.concatenate(own_pool.map(_sample_values, parts))
+            finally:
+                own_pool.close()
+                own_pool.join()
+
+    se = numpy.std(values)
+
+    if ci == BCA_CI:
+        low_p, high_p = _bca_levels(objects, sample_value, vectorized, values, alpha)
+    elif ci == PERCENTILE_CI:
+        low_p, high_p = alpha / 2, 1 - alpha / 2
+    else:
+        raise ValueError('Unknown confidence interval method: ' + str(ci))
+
+    # Only the two order statistics of the interval are needed, so there is no
+    # need to sort all the values.
+    lower = min(int(num_samples * low_p), num_samples - 1)
+    upper = max(min(int(math.ceil(num_samples * high_p)) - 1, num_samples - 1), 0)
+    values.partition((lower, upper))
+
+    return (values[lower], values[upper], se)
+
+# Draws num_samples bootstrapped samples and returns the array of their values.
+# The arguments come as one tuple so that this can be mapped over a pool. A
+# seed of None draws from numpy's global random state.
+def _sample_values(args):
+    objects, sample_value, num_samples, sample_size, vectorized, seed = args
+    rng = numpy.random if seed is None else numpy.random.RandomState(seed)
+
+    if not vectorized:
+        samples = rng.choice(objects, size=(num_samples, sample_size),
+                             replace=True).tolist()
+        return numpy.array(map(sample_value, samples), dtype=float)
+
+    data = numpy.asarray(objects)
+    values = numpy.empty(num_samples)
+
+    rows = max(1, BOOTSTRAP_CHUNK_SIZE // max(sample_size, 1))
+    for start in range(0, num_samples, rows):
+        count = min(rows, num_samples - start)
+        indices = rng.randint(0, len(data), size=(count, sample_size))
+        values[start:start + count] = sample_value(data[indices], axis=1)
+
+    return values
+
+# Splits total into the given number of nearly equal counts.
+def _split(total, parts):
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+# Returns the adjusted percentiles of the bias corrected and accelerated
+# interval. The bias correction comes from how many bootstrapped values fall
+# below the value of the original objects, and the acceleration from the skew
+# of the jackknife values.
+def _bca_levels(objects, sample_value, vectorized, values, alpha):
+    jackknife = _jackknife_values(objects, sample_value, vectorized)
+    if vectorized:
+        theta = sample_value(numpy.asarray(objects)[numpy.newaxis], axis=1)[0]
+    else:
+        theta = sample_value(list(objects))
+
+    # A bias correction of infinity would put the whole interval at one end,
+    # so the proportion is kept just inside of (0, 1).
+    below = numpy.mean(values < theta)
+    below = min(max(below, 0.5 / len(values)), 1 - 0.5 / len(values))
+    z0 = norm.ppf(below)
+
+    diffs = jackknife.mean() - jackknife
+    denom = 6 * numpy.sum(diffs ** 2) ** 1.5
+    accel = numpy.sum(diffs ** 3) / denom if denom > 0 else 0
+
+    levels = []
+    for z in (norm.ppf(alpha / 2), norm.ppf(1 - alpha / 2)):
+        levels.append(norm.cdf(z0 + (z0 + z) / (1 - accel * (z0 + z))))
+
+    return tuple(levels)
+
+# Returns the values of sample_value over the objects with each object left out
+# in turn.
+def _jackknife_values(objects, sample_value, vectorized):
+    n = len(objects)
+    if not vectorized:
+        objects = list(objects)
+        return numpy.array([sample_value(objects[:i] + objects[i + 1:])
+                            for i in range(n)], dtype=float)
+
+    data = numpy.asarray(objects)
+    values = numpy.empty(n)
+    positions = numpy.arange(n - 1)
+
+    rows = max(1, BOOTSTRAP_CHUNK_SIZE // max(n - 1, 1))
+    for start in range(0, n, rows):
+        left_out = numpy.arange(start, min(start + rows, n))[:, numpy.newaxis]
+        indices = positions + (positions >= left_out)
+        values[start:start + len(left_out)] = sample_value(data[indices], axis=1)
+
+    return values
+
+# Statistics that can be passed to bootstrap with vectorized set. Each accepts a
+# sample, or an array of samples along with the axis the samples lie on.
+def sample_mean(samples, axis=None):
+    return numpy.mean(samples, axis=axis)
 
-    sd = _sd(values)
+def sample_median(samples, axis=None):
+    return numpy.median(samples, axis=axis)
 
-    lower = int(num_samples * 0.025)
-    upper = min(int(math.ceil(num_samples * 0.975)) - 1, num_samples - 1)
+# The proportion of values in the sample greater than 0, for example the
+# proportion of positive sentences in a sample of sentiments.
+def proportion_positive(samples, axis=None):
+    return numpy.mean(numpy.asarray(samples) > 0, axis=axis)
 
-    return (values[lower], values[upper], sd)
+# Returns a statistic for the q quantile of a sample, where q is between 0 and
+# 1.
+def sample_quantile(q):
+    return partial(_quantile, q)
 
-def _sd(values):
-    mean = reduce(lambda ag, v: ag + v, values, 0) / len(values)
-    vr = 1 / len(values) * reduce(lambda ag, v: ag + (v - mean) ** 2, values, 0)
-    return math.sqrt(vr)
+def _quantile(q, samples, axis=None):
+    return numpy.percentile(samples, q * 100, axis=axis)
@@ -0,0 +1,487 @@
+################################################################################
+#
+# Timing harness for the pipeline. It has a mode for each stage:
+#
+#   python benchmark.py parse PLAYS...
+#       Every play given (or every .txt file in a given directory) is parsed
+#       with the current Play parser and with the original regex-per-line
+#       parser kept below for reference. The atoms from both are compared so
+#       that a speedup is never reported for a parser that no longer agrees
+#       with the original.
+#
+#   python benchmark.py sentiment PLAYS...
+#       The dialogue of each act of every play is scored against a local fake
+#       CoreNLP server, once with one request at a time and once with
+#       CoreNLPClient's default concurrency, and the throughput of each is
+#       reported. The server takes SENTIMENT_LATENCY seconds per request.
+#
+#   python benchmark.py stages PLAYS...
+#       Each stage of the pipeline is timed on its own for every play: parsing,
+#       the play cache, audience tracking, indexing, dyad extraction, sentiment
+#       against a fake server and with the lexicon backend, bootstrapping, and
+#       the permutation test. The hostile dyads come from the play's annotation
+#       key, NAME.key next to NAME.txt, if there is one. The timings are also
+#       appended to RESULTS_FILENAME so that runs can be compared.
+#
+#   python benchmark.py compare [RESULTS]
+#       Compares the total time of each stage in the last two stages runs
+#       recorded in RESULTS, which defaults to RESULTS_FILENAME.
+#
+# Plays of any size to run these on can be made with playgen.py.
+#
+################################################################################
+
+from __future__ import division
+
+import datetime
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+
+import analysis
+from corenlp import CoreNLPClient
+import dyads
+import fakecorenlp
+from lexicon import LexiconSentiment
+import permutation
+import playcache
+from shakespeare import STAGE_NOTE_TYPES, Annotation, Line, Play, StageNote
+
+TIMING_REPEATS = 3
+SENTIMENT_LATENCY = 0.05
+
+RESULTS_FILENAME = 'benchmark-results.jsonl'
+STAGE_SEED = 0
+STAGE_BOOTSTRAP_SAMPLES = 1000
+STAGE_PERMUTATION_MATCHINGS = 1000
+
+# The order that the stages are run and reported in.
+STAGES = ['parse', 'cache_write', 'cache_read', 'audience', 'indexes', 'dyads',
+          'sentiment', 'lexicon', 'bootstrap', 'permutation']
+
+# The original body of Play._parse_acts, which matched each raw line against
+# the string patterns one at a time, and updated the audience with the original
+# stage note handling. It is kept here as the baseline for timing
+# and as the reference output for the current parser.
+def legacy_parse_acts(play):
+    _reset(play)
+
+    act = 0
+    scene = 0
+    line_num = 1
+    last_blank_or_ann = -1
+
+    multiline_stage_note = False
+    last_stage_notes = []
+
+    character = None
+    aud = set()
+
+    for i, line in enumerate(play.raw_lines):
+        m = re.match(Play.ACT_HEADER, line)
+        if m:
+            act = int(m.group(1))
+            character = None
+            continue
+
+        m = re.match(Play.SCENE_HEADER, line)
+        if m:
+            scene = int(m.group(1))
+            line_num = 1
+            character = None
+            continue
+
+        if re.match(Play.PADDING, line):
+            continue
+
+        if not line:
+            last_blank_or_ann = i
+            continue
+
+        if act >= 1 and scene >= 1:
+            start_index = 0
+            if i - 1 == last_blank_or_ann:
+                m = re.match(Play.CHARACTER, line)
+                if m:
+                    character = m.group(1)
+                    start_index = m.end()
+
+            line = line[start_index:]
+
+            stage_note = None
+            m = re.search(Play.STAGE_NOTES, line)
+            if m:
+                if m.group(1):
+                    stage_note = StageNote(act, scene, line_num, m.group(1), character)
+                    play.atoms.append(stage_note)
+                elif m.group(2):
+                    stage_note = StageNote(act, scene, line_num, m.group(2), character)
+                    play.atoms.append(stage_note)
+
+                    multiline_stage_note = True
+                elif m.group(3):
+                    stage_note = StageNote(act, scene, line_num, m.group(3), character)
+                    play.atoms.append(stage_note)
+
+                    multiline_stage_note = False
+
+                line = line[:m.start()] + line[m.end():]
+            elif multiline_stage_note:
+                stage_note = StageNote(act, scene, line_num, line, character)
+                play.atoms.append(stage_note)
+                line = ''
+
+            if stage_note:
+                last_stage_notes.append(stage_note)
+
+            if line:
+                if last_stage_notes:
+                    legacy_update_audience(play, aud, last_stage_notes)
+                    del last_stage_notes[:]
+
+                m = re.match(Play.ANNOTATION, line)
+                if m:
+                    a = Annotation(act, scene, line_num, m.group(1))
+                    play.atoms.append(a)
+                    line_num += 1
+                    last_blank_or_ann = i
+                else:
+                    l = Line(act, scene, line_num, line, character, aud.copy())
+                    play.atoms.append(l)
+                    try:
+                        play.character_info[character].line_count += 1
+                    except KeyError:
+                        pass
+
+                    line_num += 1
+            else:
+                line_num += 1
+
+# The original Play._update_audience_from_stage_notes, which looked up every
+# word of a stage note against the whole list of characters.
+def legacy_update_audience(play, audience, stage_notes):
+    content = reduce(lambda c, sn: c + sn.content, stage_notes, '')
+
+    for s in content.upper().split('.'):
+        verb_type = 0
+
+        f_verb = reduce(lambda f, v:
+                        v if v in s and (not f or len(v) > len(f)) else f,
+                        Play.ENTER_VERBS, None)
+        if f_verb:
+            verb_type = 1
+            idx = s.index(f_verb)
+        else:
+            f_verb = reduce(lambda f, v:
+                            v if v in s and (not f or len(v) > len(f)) else f,
+                            Play.EXIT_VERBS, None)
+            if f_verb:
+                verb_type = 2
+                idx = s.index(f_verb)
+
+        if verb_type != 0:
+            s = (s[:idx] + s[idx + len(f_verb):]).strip()
+            conjuncts = re.split('\, +AND +|\, *', s)
+            p_characters = set()
+
+            neg = False
+            for p_character in conjuncts:
+                for word in p_character.split():
+                    u = word.upper()
+                    exists = reduce(lambda flag, c: flag or u == c.name or u == c.short,
+                                    play.characters, False)
+                    if exists:
+                        if not neg:
+                            p_characters.add(word)
+                        else:
+                            p_characters.remove(word)
+                    elif word in Play.SING_PRONOUNS:
+                        p_characters.add(stage_notes[0].context)
+                    elif word in Play.PLURAL_PRONOUNS:
+                        p_characters |= audience
+                    elif word in Play.NEG_MODIFIERS:
+                        neg = True
+
+            if verb_type == 1:
+                audience |= p_characters
+            elif verb_type == 2:
+                audience -= p_characters
+
+# Parses the acts of the play again with the current parser.
+def current_parse_acts(play):
+    _reset(play)
+    play._parse_acts()
+
+# Clears everything that parsing the acts of a play accumulates.
+def _reset(play):
+    play.atoms = []
+    for info in play.character_info.values():
+        info.line_count = 0
+
+# Returns the best of TIMING_REPEATS wall clock times for parsing the acts of
+# the given play with parse, a callable that accepts the play.
+def time_parse(play, parse):
+    best = None
+    for _ in range(TIMING_REPEATS):
+        start = time.time()
+        parse(play)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+# Expands the command line arguments into a list of play filenames. Directories
+# contribute all of their .txt files.
+def play_filenames(paths):
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.txt'):
+                    filenames.append(os.path.join(path, name))
+        else:
+            filenames.append(path)
+
+    return filenames
+
+# Returns the best of TIMING_REPEATS wall clock times for calling func with no
+# arguments, along with what the last call returned.
+def time_call(func):
+    best = None
+    for _ in range(TIMING_REPEATS):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best, result
+
+# Replays the audience tracking of the play. Each run of stage notes updates
+# the audience in turn, as it does while the acts are parsed.
+def replay_audience(play):
+    audience = set()
+    stage_notes = []
+    for atom in play.atoms:
+        if isinstance(atom, STAGE_NOTE_TYPES):
+            stage_notes.append(atom)
+        elif stage_notes:
+            play._update_audience_from_stage_notes(audience, stage_notes)
+            stage_notes = []
+
+    return audience
+
+# Returns the hostile dyads from the annotation key of the play file, or none if
+# it does not have one.
+def hostile_dyads_of(filename):
+    key_filename = os.path.splitext(filename)[0] + '.key'
+    if os.path.isfile(key_filename):
+        return dyads.read_annotation_key(key_filename)
+
+    return {}
+
+# Times each stage of the pipeline on the play in filename, and returns a dict
+# from stage name to seconds. The sentiment stage goes to the given fake
+# server, and the bootstraps are run on pool.
+def time_stages(filename, server, pool):
+    timings = {}
+
+    timings['parse'], play = time_call(lambda: Play(filename))
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(cache_dir, 'play')
+        timings['cache_write'], _ = time_call(lambda: playcache.write_play(play, path))
+        timings['cache_read'], _ = time_call(lambda: playcache.read_play(path, filename))
+    finally:
+        shutil.rmtree(cache_dir)
+
+    timings['audience'], _ = time_call(lambda: replay_audience(play))
+
+    def index():
+        play._indexes = None
+        return play._get_indexes()
+    timings['indexes'], _ = time_call(index)
+
+    hostile_dyads = hostile_dyads_of(filename)
+    def extract():
+        rng = numpy.random.RandomState(STAGE_SEED)
+        non_hostile_dyads = dyads.choose_non_hostile_dyads(play, hostile_dyads, rng)
+        return dyads.collect_dyad_lines(play, hostile_dyads, non_hostile_dyads)
+    timings['dyads'], lines = time_call(extract)
+    diags = [' '.join(group) for group in lines]
+
+    # The server is slow on purpose, so the sentiment is only timed once.
+    client = CoreNLPClient(server.url)
+    start = time.time()
+    sents = analysis.sentiment_many(client, diags)
+    timings['sentiment'] = time.time() - start
+    client.close()
+
+    backend = LexiconSentiment(fakecorenlp.POSITIVE_WORDS, fakecorenlp.NEGATIVE_WORDS)
+    timings['lexicon'], _ = time_call(lambda: analysis.sentiment_many(backend, diags))
+
+    timings['bootstrap'], _ = time_call(lambda: [
+        dyads.group_statistics(diag, group_sents, STAGE_BOOTSTRAP_SAMPLES,
+                               dyads.group_seed(STAGE_SEED, i), pool=pool)
+        for i, (diag, group_sents) in enumerate(zip(diags, sents))])
+
+    timings['permutation'], _ = time_call(lambda: permutation.permutation_test(
+        play, hostile_dyads, backend, num_matchings=STAGE_PERMUTATION_MATCHINGS,
+        seed=STAGE_SEED))
+
+    return len(play.atoms), timings
+
+# Appends a run to the results file, along with when it was run and the git
+# revision of the code, if there is one.
+def record_results(mode, results, filename=RESULTS_FILENAME):
+    try:
+        with open(os.devnull, 'w') as devnull:
+            revision = subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    run = {
+        'mode': mode,
+        'time': datetime.datetime.now().isoformat(),
+        'revision': revision,
+        'results': results
+    }
+    with open(filename, 'a') as f:
+        f.write(json.dumps(run, sort_keys=True) + '\n')
+
+################################################################################
+#
+# Main script.
+#
+################################################################################
+
+# Times parsing each of the plays with the original and the current parser.
+def benchmark_parse(filenames):
+    total_before = 0
+    total_after = 0
+    for filename in filenames:
+        play = Play(filename)
+
+        before = time_parse(play, legacy_parse_acts)
+        expected = play.atoms
+
+        after = time_parse(play, current_parse_acts)
+        if play.atoms != expected:
+            raise AssertionError('Atoms differ from the original parser for ' + filename)
+
+        total_before += before
+        total_after += after
+        print '{}: {} atoms, before {:.4f}s, after {:.4f}s, speedup {:.2f}x'.format(
+            filename, len(expected), before, after, before / after)
+
+    print 'Total: before {:.4f}s, after {:.4f}s, speedup {:.2f}x'.format(
+        total_before, total_after, total_before / total_after)
+
+# Times scoring the dialogue of each act of the plays against a fake server,
+# with a serial client and with a concurrent one.
+def benchmark_sentiment(filenames):
+    texts = []
+    for filename in filenames:
+        acts = {}
+        for atom in Play(filename).atoms:
+            if isinstance(atom, Line):
+                acts.setdefault(atom.act, []).append(atom.content)
+        texts.extend(' '.join(acts[act]) for act in sorted(acts))
+
+    server = fakecorenlp.start(latency=SENTIMENT_LATENCY)
+    try:
+        expected = None
+        for concurrency in (1, CoreNLPClient.DEFAULT_CONCURRENCY):
+            client = CoreNLPClient(server.url, concurrency=concurrency)
+            server.requests = 0
+            server.chars = 0
+
+            start = time.time()
+            scores = analysis.sentiment_many(client, texts, step=5000)
+            elapsed = time.time() - start
+            client.close()
+
+            if expected is None:
+                expected = scores
+            elif scores != expected:
+                raise AssertionError('Scores differ between concurrency levels')
+
+            print 'Concurrency {}: {} requests, {} chars in {:.3f}s, {:.1f} requests/s, {:.0f} chars/s'.format(
+                concurrency, server.requests, server.chars, elapsed,
+                server.requests / elapsed, server.chars / elapsed)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+# Times each stage of the pipeline on each of the plays and records the
+# results.
+def benchmark_stages(filenames):
+    server = fakecorenlp.start(latency=SENTIMENT_LATENCY)
+    pool = multiprocessing.Pool(dyads.BOOTSTRAP_WORKERS)
+    results = {}
+    try:
+        for filename in filenames:
+            atoms, timings = time_stages(filename, server, pool)
+            results[filename] = {'atoms': atoms, 'stages': timings}
+
+            print '{}: {} atoms'.format(filename, atoms)
+            for stage in STAGES:
+                print '  {:<12} {:.4f}s'.format(stage, timings[stage])
+    finally:
+        pool.close()
+        pool.join()
+        server.shutdown()
+        server.server_close()
+
+    record_results('stages', results)
+
+# Compares the total time of each stage between the last two stages runs in
+# the results file.
+def benchmark_compare(filenames):
+    filename = filenames[0] if filenames else RESULTS_FILENAME
+    with open(filename, 'r') as f:
+        runs = [json.loads(line) for line in f if line.strip()]
+    runs = [run for run in runs if run['mode'] == 'stages'][-2:]
+    if len(runs) < 2:
+        raise ValueError('There are not two stages runs to compare in ' + filename)
+
+    totals = []
+    for run in runs:
+        total = dict((stage, 0) for stage in STAGES)
+        for result in run['results'].values():
+            for stage, seconds in result['stages'].items():
+                total[stage] = total.get(stage, 0) + seconds
+        totals.append(total)
+
+    print 'Before: {} ({})'.format(runs[0]['time'], runs[0]['revision'])
+    print 'After:  {} ({})'.format(runs[1]['time'], runs[1]['revision'])
+    for stage in STAGES:
+        before, after = totals[0].get(stage, 0), totals[1].get(stage, 0)
+        ratio = before / after if after else float('nan')
+        print '  {:<12} {:.4f}s -> {:.4f}s, {:.2f}x'.format(stage, before, after, ratio)
+
+BENCHMARKS = {
+    'parse': benchmark_parse,
+    'sentiment': benchmark_sentiment,
+    'stages': benchmark_stages,
+    'compare': benchmark_compare
+}
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS or \
+       (len(sys.argv) < 3 and sys.argv[1] != 'compare'):
+        raise TypeError('Illegal number of arguments.')
+
+    BENCHMARKS[sys.argv[1]](play_filenames(sys.argv[2:]))
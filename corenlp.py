@@ -0,0 +1,113 @@
+################################################################################
+#
+# A client for the StanfordCoreNLP server that keeps several requests in flight
+# at once. It has the same annotate method as the pycorenlp client so it can be
+# used anywhere that one is, but it holds on to a pool of HTTP connections and
+# retries requests that time out. The pipeline method runs calls on a pool of
+# threads while keeping the results in order, which is what lets the sentiment
+# of many batches be fetched at once.
+#
+################################################################################
+
+from collections import deque
+import json
+from multiprocessing.pool import ThreadPool
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_END = object()
+
+class CoreNLPClient(object):
+    DEFAULT_URL = 'http://localhost:9000'
+    DEFAULT_CONCURRENCY = 4
+
+    # The StanfordCoreNLP server is started with a 30 second timeout, so a
+    # request that has not returned long after that is not coming back.
+    DEFAULT_TIMEOUT = 60
+    DEFAULT_RETRIES = 3
+    DEFAULT_BACKOFF = 1.0
+
+    # At most concurrency requests are in flight at once. A request that times
+    # out, can not connect, or fails on the server is tried again up to retries
+    # more times, waiting backoff seconds before the first retry and twice as
+    # long before each one after that.
+    def __init__(self, url=DEFAULT_URL, concurrency=DEFAULT_CONCURRENCY,
+                 timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF):
+        self.url = url
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._threads = None
+
+    # Annotates the text with the given properties. If the output format is
+    # json, then the decoded result is returned, and otherwise the text of the
+    # response.
+    def annotate(self, text, properties=None):
+        properties = properties or {}
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+
+        attempt = 0
+        while True:
+            try:
+                r = self.session.post(self.url,
+                                      params={'properties': json.dumps(properties)},
+                                      data=text, timeout=self.timeout)
+                if r.status_code < 500:
+                    r.raise_for_status()
+                    break
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                if attempt >= self.retries:
+                    raise
+            else:
+                if attempt >= self.retries:
+                    r.raise_for_status()
+
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+        if properties.get('outputFormat') == 'json':
+            return r.json()
+
+        return r.text
+
+    # Calls func on each of the items, with up to concurrency calls running at
+    # once, and yields the results in the order of the items. The next item is
+    # only taken from the iterable once there is room for it, which is after
+    # the result before it has been handed back. So a lazily built iterable can
+    # react to the results that came before.
+    def pipeline(self, func, items):
+        if self._threads is None:
+            self._threads = ThreadPool(self.concurrency)
+
+        items = iter(items)
+        pending = deque()
+        while True:
+            if len(pending) >= self.concurrency:
+                yield pending.popleft().get()
+
+            item = next(items, _END)
+            if item is _END:
+                break
+            pending.append(self._threads.apply_async(func, (item,)))
+
+        while pending:
+            yield pending.popleft().get()
+
+    def close(self):
+        if self._threads is not None:
+            self._threads.close()
+            self._threads.join()
+            self._threads = None
+
+        self.session.close()
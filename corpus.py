@@ -0,0 +1,166 @@
+################################################################################
+#
+# Runs the dyad analysis of main.py over a whole corpus of plays at once, and
+# writes the statistics of every group of every play to one results file. The
+# plays are parsed in parallel on a pool of processes, all of their dialogue is
+# scored through the same sentiment client and cache, and the bootstraps share
+# the same pool that did the parsing. So the run takes about as long as its
+# slowest play rather than the sum of all of them.
+#
+# The plays are given either as a manifest, where each line is the filename of
+# a play and of its annotation key separated by a comma, or as a directory,
+# where each NAME.txt that has a NAME.key next to it is a play. Relative paths
+# in a manifest are relative to the manifest. The results are written as json
+# lines, one object per play and group, unless the output ends in .csv.
+#
+#   python corpus.py PLAYS OUTPUT [seed]
+#
+################################################################################
+
+from __future__ import division
+
+import csv
+import json
+import multiprocessing
+import os
+import sys
+
+import numpy
+
+import analysis
+from corenlp import CoreNLPClient
+import dyads
+import playcache
+
+PLAY_EXTENSION = '.txt'
+KEY_EXTENSION = '.key'
+
+# The columns of the results, in the order they are written to a csv.
+RESULT_FIELDS = ('play', 'title', 'seed', 'group') + dyads.GroupStats._fields
+
+# Returns the (play, annotation key) filename pairs of the corpus, from either
+# a manifest file or a directory of plays.
+def corpus_entries(path):
+    if os.path.isdir(path):
+        entries = []
+        for name in sorted(os.listdir(path)):
+            base, ext = os.path.splitext(name)
+            key = os.path.join(path, base + KEY_EXTENSION)
+            if ext == PLAY_EXTENSION and os.path.isfile(key):
+                entries.append((os.path.join(path, name), key))
+
+        return entries
+
+    root = os.path.dirname(path)
+    entries = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            items = [item.strip() for item in line.split(',')]
+            if len(items) != 2:
+                raise ValueError('Manifest line is not a play and a key: ' + line)
+            entries.append(tuple(os.path.join(root, item) for item in items))
+
+    return entries
+
+# Analyzes the corpus in entries and returns one result dict for each group of
+# each play, in the order of the entries. The non hostile dyads of each play
+# are chosen with their own seed, which are all drawn from seed, so a run can
+# be repeated exactly by giving the same seed. A seed of None draws a fresh one.
+def analyze_corpus(entries, nlp, cache=None, pool=None, seed=None,
+                   cache_dir=playcache.DEFAULT_CACHE_DIR):
+    rng = numpy.random if seed is None else numpy.random.RandomState(seed)
+    seeds = rng.randint(0, 2 ** 31 - 1, size=len(entries))
+    jobs = [(play_filename, key_filename, play_seed, cache_dir)
+            for (play_filename, key_filename), play_seed in zip(entries, seeds)]
+
+    plays = pool.map(_collect_play, jobs) if pool else map(_collect_play, jobs)
+
+    # Every group of every play goes to the server together, so that the
+    # requests of one play do not have to wait on those of another.
+    diags = [diag for _, _, _, play_diags in plays for diag in play_diags]
+    sents = analysis.sentiment_many(nlp, diags, cache=cache)
+
+    results = []
+    for i, (play_filename, title, play_seed, play_diags) in enumerate(plays):
+        for j, (group, diag) in enumerate(zip(dyads.GROUPS, play_diags)):
+            group_sents = sents[i * len(dyads.GROUPS) + j]
+            stats = dyads.group_statistics(diag, group_sents,
+                                           seed=dyads.group_seed(play_seed, j),
+                                           pool=pool)
+
+            result = {'play': play_filename, 'title': title, 'seed': play_seed,
+                      'group': group}
+            result.update(stats._asdict())
+            results.append(result)
+
+    return results
+
+# Loads one play of the corpus, chooses its non hostile dyads, and returns the
+# dialogue of each of its groups. Only the text is sent back to the parent
+# process, since the play itself is much larger.
+def _collect_play(args):
+    play_filename, key_filename, seed, cache_dir = args
+
+    play = playcache.load_play(play_filename, cache_dir)
+    hostile_dyads = dyads.read_annotation_key(key_filename)
+    non_hostile_dyads = dyads.choose_non_hostile_dyads(
+        play, hostile_dyads, numpy.random.RandomState(seed))
+
+    diags = [' '.join(lines) for lines in
+             dyads.collect_dyad_lines(play, hostile_dyads, non_hostile_dyads)]
+
+    return play_filename, play.title, int(seed), diags
+
+def write_results(filename, results):
+    with open(filename, 'wb') as f:
+        if filename.endswith('.csv'):
+            writer = csv.DictWriter(f, RESULT_FIELDS)
+            writer.writeheader()
+            for result in results:
+                writer.writerow({k: _encode(v) for k, v in result.items()})
+        else:
+            for result in results:
+                f.write(json.dumps(result, sort_keys=True) + '\n')
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+
+    return value
+
+################################################################################
+#
+# Main script.
+#
+################################################################################
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        raise TypeError('Illegal number of arguments.')
+
+    corpus_path = sys.argv[1]
+    output_filename = sys.argv[2]
+    seed = int(sys.argv[3]) if len(sys.argv) >= 4 else dyads.BOOTSTRAP_SEED
+
+    entries = corpus_entries(corpus_path)
+    nlp = CoreNLPClient()
+    sentiment_cache = analysis.SentimentCache()
+    pool = multiprocessing.Pool(dyads.BOOTSTRAP_WORKERS)
+
+    try:
+        results = analyze_corpus(entries, nlp, sentiment_cache, pool, seed)
+    finally:
+        pool.close()
+        pool.join()
+        nlp.close()
+        sentiment_cache.close()
+
+    write_results(output_filename, results)
+
+    print 'Plays analyzed: ' + str(len(entries))
+    print 'Sentiment cache hits: ' + str(sentiment_cache.hits)
+    print 'Sentiment cache misses: ' + str(sentiment_cache.misses)
@@ -0,0 +1,288 @@
+################################################################################
+#
+# The dyad analysis behind main.py, kept apart from the script so that it can
+# be run on many plays at once. A dyad is a pair of characters, where the first
+# is taken as the betrayer and the second as the victim. The hostile dyads come
+# from a play's annotation key, and the non hostile dyads are chosen at random
+# from the rest of the characters. The dialogue of each side of the dyads is
+# scored for sentiment and summarized in GroupStats.
+#
+################################################################################
+
+from __future__ import division
+
+from collections import namedtuple
+from functools import partial
+import multiprocessing
+
+import numpy
+
+import analysis
+import instrument
+from matching import DyadGraph
+
+BOOTSTRAP_NUM_SAMPLES = 5000
+BOOTSTRAP_SAMPLE_SIZE = 100
+
+# The bootstrap replicates are split into this many independently seeded parts
+# that run in parallel. The results are reproducible for a given seed and
+# number of workers, and a seed of None draws a fresh one from numpy.
+BOOTSTRAP_WORKERS = multiprocessing.cpu_count()
+BOOTSTRAP_SEED = None
+
+# The groups of dialogue that are analyzed, in the order that
+# collect_dyad_lines returns them.
+GROUPS = ('betrayer', 'victim', 'arb_betrayer', 'arb_victim')
+
+# The summary of the sentiment of one group of dialogue. The confidence
+# interval and SE are bootstrapped estimates of the percent positive.
+GroupStats = namedtuple('GroupStats', ['sentences', 'words', 'percent_positive',
+                                       'ci_low', 'ci_high', 'se'])
+
+# The annotation key is the file that explicitly states which annotation ids
+# are associated with which characters. These are all the hostile dyads that
+# will be tracked in the play. The dyads are returned as a dict from the dyad to
+# the pair of annotation ids.
+def read_annotation_key(filename):
+    hostile_dyads = {}
+    with open(filename, 'r') as f:
+        for line in f:
+            items = line.rstrip().split(', ')
+            hostile_dyads[tuple(items[1:3])] = (items[0], items[3])
+
+    return hostile_dyads
+
+# Now we have to find out all the non-hostile dyads and arbitrairly assign a
+# betrayer and victim to them. The non hostile dyads are a random maximal
+# matching of the characters with enough lines, where no hostile dyad can be
+# chosen in either order. The random choices are drawn from rng, which is
+# numpy's global random state unless a RandomState is given.
+def choose_non_hostile_dyads(play, hostile_dyads, rng=numpy.random):
+    return non_hostile_graph(play, hostile_dyads).sample(rng)
+
+# Returns the DyadGraph of the pairs of characters that can be non hostile
+# dyads.
+def non_hostile_graph(play, hostile_dyads):
+    names = filter(partial(valid_non_hostile, play),
+                   map(lambda c: c.short or c.name, play.characters))
+
+    return DyadGraph(names, hostile_dyads)
+
+def valid_non_hostile(play, c_name):
+    return play.character_info[c_name].line_count > 50
+
+# Condense the PlayAtoms of the given character from the provided list (which may
+# include lines from other characters) into sentences. This will return one
+# continuous string of the desired characters dialogue from the given PlayAtoms.
+def condense_character_lines(character, lines):
+    blurbs = []
+
+    for line in lines:
+        try:
+            if character == line.speaker:
+                blurbs.append(line.content)
+        except AttributeError:
+            # The given line is not dialogue, in which case we don't care about
+            # it.
+            pass
+
+    return ' '.join(blurbs)
+
+# Collects the dialogue between the hostile dyads and between the non hostile
+# dyads of the play. A hostile dyad is given as a key of hostile_dyads, and is
+# only tracked up until the annotation that marks the beginning of its
+# hostility, which is found from the annotation ids that the dyad maps to. A
+# line that belongs to a hostile dyad is never counted for a non hostile dyad.
+# The content of the matching lines is returned as four lists, the betrayer and
+# victim lines of the hostile dyads, followed by the same for the non hostile
+# dyads. Each list is in the order of the play.
+def collect_dyad_lines(play, hostile_dyads, non_hostile_dyads, candidates=None):
+    positions = collect_dyad_positions(play, hostile_dyads, non_hostile_dyads,
+                                       candidates)
+
+    return tuple([play.atoms[i].content for i in side] for side in positions)
+
+# The same as collect_dyad_lines, but returns the positions of the lines in the
+# play's atoms rather than their content.
+#
+# The atoms are routed to their groups by a DyadRouter in a single pass over
+# the play. If the positions of the atoms that may be hostility annotations are
+# given as candidates, as found by hostile_candidates, then only those atoms
+# are checked for annotations.
+#
+# The pass is timed and counted as the given stage, so that a pass that only
+# finds the positions ahead of another one, such as the stream of
+# pipeline.analyze_stream, is not counted as part of it.
+def collect_dyad_positions(play, hostile_dyads, non_hostile_dyads, candidates=None,
+                           stage='dyads'):
+    with instrument.timer(stage):
+        router = DyadRouter(hostile_dyads, non_hostile_dyads)
+        if candidates is not None:
+            candidates = set(candidates)
+
+        groups = tuple([] for _ in GROUPS)
+        for i, atom in enumerate(play.atoms):
+            for group in router.route(atom, candidates is None or i in candidates):
+                groups[group].append(i)
+
+        instrument.count(stage + '.atoms_routed', len(play.atoms))
+        instrument.count(stage + '.match_checks', router.checks)
+
+        return groups
+
+# Returns the positions of the atoms that may be hostility annotations. Every
+# hostility marker contains this text, which is much cheaper to look for than
+# running each dyad's pattern over the whole play.
+def hostile_candidates(play):
+    instrument.count('dyads.atoms_scanned', len(play.atoms))
+    return [i for i, atom in enumerate(play.atoms) if '_HOSTILE_' in atom.content]
+
+# Sends each atom of a play to the groups of dialogue it belongs to, where the
+# groups are numbered in the order of GROUPS. The atoms have to be routed in
+# the order of the play, since a hostile dyad stops being tracked once its
+# annotation has been seen.
+#
+# Only the atoms that hold the text every hostility marker shares are checked
+# for the marker of each dyad, and the lines are looked up by their speaker, so
+# the cost of routing a line only depends on the dyads that its speaker is in
+# rather than on all of the dyads.
+class DyadRouter(object):
+    HOSTILE_MARKER = '{}_HOSTILE_{}_BEGIN'
+
+    def __init__(self, hostile_dyads, non_hostile_dyads):
+        # Each route is (listener, order, group) and is kept under the speaker.
+        # The dyads are added in order, so within a speaker the routes are in
+        # the order of their dyads, and an atom is added to a group once for
+        # each dyad it matches, in order.
+        self._hostile_routes = {}
+        self._markers = {}
+        self._active = []
+        for order, (dyad, info) in enumerate(hostile_dyads.items()):
+            self._active.append(bool(info))
+            if not info:
+                continue
+
+            marker = DyadRouter.HOSTILE_MARKER.format(info[0], info[1])
+            self._markers.setdefault(marker, []).append(order)
+            self._add_routes(self._hostile_routes, dyad, order, 0)
+
+        self._non_hostile_routes = {}
+        for order, dyad in enumerate(non_hostile_dyads):
+            self._add_routes(self._non_hostile_routes, dyad, order, 2)
+
+        # Each marker is looked for on its own, since the marker of one dyad
+        # may be a part of another's, such as 1_HOSTILE_12_BEGIN in
+        # 11_HOSTILE_12_BEGIN, and both dyads end there.
+        self._marker_list = self._markers.items()
+
+        self.checks = 0
+
+    # Returns the groups that the atom goes to, in order. The atom is only
+    # checked for annotations if may_be_marker is set.
+    def route(self, atom, may_be_marker=True):
+        if may_be_marker and self._marker_list and '_HOSTILE_' in atom.content:
+            for marker, orders in self._marker_list:
+                if marker in atom.content:
+                    for order in orders:
+                        self._active[order] = False
+
+        speaker = getattr(atom, 'speaker', None)
+        if speaker is None:
+            return []
+
+        groups = self._match(self._hostile_routes.get(speaker), atom.audience, self._active)
+        if groups:
+            return groups
+
+        return self._match(self._non_hostile_routes.get(speaker), atom.audience, None)
+
+    # Adds the routes of the dyad, where the first character's lines to the
+    # second go to group and the second's lines to the first go to the group
+    # after it.
+    @staticmethod
+    def _add_routes(routes, dyad, order, group):
+        routes.setdefault(dyad[0], []).append((dyad[1], order, group))
+        routes.setdefault(dyad[1], []).append((dyad[0], order, group + 1))
+
+    # Returns the groups of the routes whose listener is in the audience. A
+    # line only counts once per dyad, as the betrayer's if it can be either.
+    def _match(self, routes, audience, active):
+        groups = []
+        if not routes:
+            return groups
+
+        last_order = None
+        for listener, order, group in routes:
+            self.checks += 1
+            if order == last_order or (active is not None and not active[order]):
+                continue
+
+            if listener in audience:
+                groups.append(group)
+                last_order = order
+
+        return groups
+
+def sentiments_to_percent_positive(sents):
+    return sum(s > 0 for s in sents) / len(sents)
+
+# Summarizes the sentiment of a group of dialogue, where diag is the text of
+# the dialogue and sents the sentiment of each of its sentences. The remaining
+# arguments are passed along to analysis.bootstrap. A group without any
+# sentences is all zeros.
+def group_statistics(diag, sents, num_samples=BOOTSTRAP_NUM_SAMPLES,
+                     seed=BOOTSTRAP_SEED, workers=BOOTSTRAP_WORKERS, pool=None):
+    return sentence_statistics(sents, len(diag.split(' ')), num_samples, seed,
+                               workers, pool)
+
+# The same as group_statistics, but takes the number of words of the dialogue
+# rather than its text, for when the text is never put together.
+def sentence_statistics(sents, words, num_samples=BOOTSTRAP_NUM_SAMPLES,
+                        seed=BOOTSTRAP_SEED, workers=BOOTSTRAP_WORKERS, pool=None):
+    if len(sents) > 0:
+        p = sentiments_to_percent_positive(sents)
+        bootstrap = analysis.bootstrap(sents, analysis.proportion_positive,
+                                       num_samples, vectorized=True, seed=seed,
+                                       workers=workers, pool=pool)
+    else:
+        p = 0
+        bootstrap = (0, 0, 0)
+
+    return GroupStats(len(sents), words, p, *bootstrap)
+
+# Returns the seed of the bootstrap of the group at the given index of GROUPS,
+# so that the groups do not all resample their sentences the same way. A seed
+# of None stays None.
+def group_seed(seed, group_index):
+    return None if seed is None else seed + group_index
+
+# Returns the GroupStats of each of the groups of lines in positions, as found
+# by collect_dyad_positions, each bootstrapped with its group_seed. If a
+# RunState is given as state, then a group that was computed from the same
+# lines and bootstrap parameters before is taken from it, and only the rest are
+# scored and bootstrapped. The state is updated with the new groups but is not
+# saved.
+def analyze_groups(play, positions, nlp, cache=None, state=None,
+                   num_samples=BOOTSTRAP_NUM_SAMPLES, seed=BOOTSTRAP_SEED,
+                   workers=BOOTSTRAP_WORKERS, pool=None):
+    params = [(analysis.backend_config(nlp), num_samples, group_seed(seed, i), workers)
+              for i in range(len(GROUPS))]
+
+    stats = [None] * len(positions)
+    if state is not None:
+        for i, (group, lines) in enumerate(zip(GROUPS, positions)):
+            stored = state.group_stats(group, lines, params[i])
+            if stored is not None:
+                stats[i] = GroupStats(*stored)
+
+    todo = [i for i, s in enumerate(stats) if s is None]
+    diags = [' '.join(play.atoms[j].content for j in positions[i]) for i in todo]
+    sents = analysis.sentiment_many(nlp, diags, cache=cache)
+
+    for i, diag, group_sents in zip(todo, diags, sents):
+        stats[i] = group_statistics(diag, group_sents, num_samples,
+                                    group_seed(seed, i), workers, pool)
+        if state is not None:
+            state.set_group_stats(GROUPS[i], positions[i], params[i], stats[i])
+
+    return stats
@@ -0,0 +1,133 @@
+################################################################################
+#
+# A stand in for the StanfordCoreNLP server, for measuring the sentiment path
+# offline. It answers annotate requests with the same json shape as the real
+# server: one entry per sentence, with the tokens' character offsets and a
+# sentiment value. The sentences are split on terminal punctuation and the
+# sentiment comes from a handful of words, so the scores mean nothing, but they
+# are deterministic. Each request can be made to take a fixed amount of time
+# plus an amount per character, to look like a loaded server.
+#
+# Run it directly to serve on a port:
+#   python fakecorenlp.py 9000 [latency] [latency per char]
+#
+################################################################################
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import json
+import re
+from SocketServer import ThreadingMixIn
+import sys
+import threading
+import time
+
+SENTENCE = re.compile(r'[^.!?\s][^.!?]*(?:[.!?]+|$)', re.UNICODE)
+TOKEN = re.compile(r'\w+|[^\w\s]', re.UNICODE)
+
+POSITIVE_WORDS = frozenset(['good', 'love', 'loved', 'dear', 'kind', 'noble',
+                            'sweet', 'fair', 'joy', 'happy', 'gentle', 'honest'])
+NEGATIVE_WORDS = frozenset(['villain', 'hate', 'false', 'foul', 'vile', 'base',
+                            'traitor', 'curse', 'death', 'monster', 'wicked'])
+
+# Returns the fake annotation of the given unicode text, in the shape of the
+# server's json output.
+def annotate(text):
+    sentences = []
+    for i, m in enumerate(SENTENCE.finditer(text)):
+        tokens = []
+        score = 0
+        for j, t in enumerate(TOKEN.finditer(m.group(0))):
+            word = t.group(0)
+            tokens.append({
+                'index': j + 1,
+                'word': word,
+                'characterOffsetBegin': m.start() + t.start(),
+                'characterOffsetEnd': m.start() + t.end()
+            })
+
+            word = word.lower()
+            if word in POSITIVE_WORDS:
+                score += 1
+            elif word in NEGATIVE_WORDS:
+                score -= 1
+
+        if score > 0:
+            value = 3
+        elif score < 0:
+            value = 1
+        else:
+            value = 2
+
+        sentences.append({
+            'index': i,
+            'tokens': tokens,
+            'sentimentValue': str(value),
+            'sentiment': ['Negative', 'Negative', 'Neutral', 'Positive'][value]
+        })
+
+    return {'sentences': sentences}
+
+class FakeCoreNLPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    # Every request sleeps for latency seconds, plus latency_per_char seconds
+    # for each character of its text. The number of requests and characters
+    # served are counted in requests and chars.
+    def __init__(self, address, latency=0.0, latency_per_char=0.0):
+        HTTPServer.__init__(self, address, _Handler)
+        self.latency = latency
+        self.latency_per_char = latency_per_char
+        self.requests = 0
+        self.chars = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address)
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        text = self.rfile.read(length).decode('utf-8')
+
+        server = self.server
+        with server._lock:
+            server.requests += 1
+            server.chars += len(text)
+        time.sleep(server.latency + server.latency_per_char * len(text))
+
+        body = json.dumps(annotate(text))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# Starts a fake server in a background thread and returns it. The default port
+# of 0 picks any free port, which can be found through the server's url.
+def start(port=0, latency=0.0, latency_per_char=0.0):
+    server = FakeCoreNLPServer(('localhost', port), latency, latency_per_char)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server
+
+################################################################################
+#
+# Main script.
+#
+################################################################################
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        raise TypeError('Illegal number of arguments.')
+
+    port = int(sys.argv[1])
+    latency = float(sys.argv[2]) if len(sys.argv) >= 3 else 0.0
+    latency_per_char = float(sys.argv[3]) if len(sys.argv) >= 4 else 0.0
+
+    FakeCoreNLPServer(('localhost', port), latency, latency_per_char).serve_forever()
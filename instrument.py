@@ -0,0 +1,207 @@
+################################################################################
+#
+# Lightweight timers and counters for finding out where the time of a run goes.
+# Everything here is off until enable is called, and while it is off the calls
+# spread through the pipeline do next to nothing, so they can stay in place.
+#
+# There are three kinds of measurements, all named with dotted strings:
+#   timers      the number of calls and total seconds of a stage of the run,
+#               measured with the timer context manager
+#   counters    counts of things, such as lines parsed or requests sent
+#   histograms  distributions of values, such as request latencies, kept as
+#               counts in fixed buckets
+# A counter whose name starts with the name of a timer, such as
+# bootstrap.replicates and the timer bootstrap, is also reported as a rate per
+# second of that timer.
+#
+# One stage can also be profiled with cProfile, by naming it when enabling. The
+# profile only covers the time inside that stage's timer.
+#
+# A stage that is a stream, pulling its input from the stage before it and
+# handing its output on one item at a time, is timed with timed_stream, which
+# leaves out the time spent in the stages on either side of it.
+#
+################################################################################
+
+from __future__ import division
+
+import bisect
+import cProfile
+from contextlib import contextmanager
+import json
+import time
+
+# The upper bounds of the histogram buckets. The last bucket holds everything
+# larger.
+HISTOGRAM_BOUNDS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+                    1, 2, 5, 10, 20, 50, 100]
+
+enabled = False
+
+_END = object()
+
+_timers = {}
+_counters = {}
+_histograms = {}
+_profile_stage = None
+_profiler = None
+
+# Turns on the measurements, and clears any that were made before. If
+# profile_stage is given, then the time spent in the timer of that name is
+# profiled with cProfile.
+def enable(profile_stage=None):
+    global enabled, _profile_stage, _profiler
+
+    reset()
+    enabled = True
+    _profile_stage = profile_stage
+    _profiler = cProfile.Profile() if profile_stage else None
+
+def disable():
+    global enabled
+
+    enabled = False
+
+_END = object()
+
+def reset():
+    _timers.clear()
+    _counters.clear()
+    _histograms.clear()
+
+def count(name, n=1):
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+def observe(name, value):
+    if enabled:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = [0] * (len(HISTOGRAM_BOUNDS) + 1) + [0, None, None]
+
+        histogram[bisect.bisect_left(HISTOGRAM_BOUNDS, value)] += 1
+
+        # The last three entries are the sum, min and max of the values.
+        histogram[-3] += value
+        if histogram[-2] is None or value < histogram[-2]:
+            histogram[-2] = value
+        if histogram[-1] is None or value > histogram[-1]:
+            histogram[-1] = value
+
+# Times the body of a with statement as the stage name. Timers of the same
+# name add up, but a timer inside another of the same name is not counted
+# twice.
+@contextmanager
+def timer(name):
+    if not enabled:
+        yield
+        return
+
+    # The entry is the number of calls, the total seconds, how deeply the timer
+    # is nested, and when it last started running.
+    entry = _timers.setdefault(name, [0, 0.0, 0, None])
+    entry[2] += 1
+    profiling = entry[2] == 1 and name == _profile_stage
+    if entry[2] == 1:
+        entry[3] = time.time()
+    if profiling:
+        _profiler.enable()
+
+    try:
+        yield
+    finally:
+        entry[2] -= 1
+        if entry[2] == 0:
+            entry[0] += 1
+            if entry[3] is not None:
+                entry[1] += time.time() - entry[3]
+        if profiling:
+            _profiler.disable()
+
+# Stops the running timer of the given name for the body of a with statement.
+@contextmanager
+def _paused(name):
+    entry = _timers.get(name)
+    if entry is None or entry[2] == 0 or entry[3] is None:
+        yield
+        return
+
+    entry[1] += time.time() - entry[3]
+    entry[3] = None
+    profiling = name == _profile_stage
+    if profiling:
+        _profiler.disable()
+
+    try:
+        yield
+    finally:
+        entry[3] = time.time()
+        if profiling:
+            _profiler.enable()
+
+# Returns the stream that make_stream builds from items, with the work of
+# producing each of its items timed as the stage name. The time spent getting
+# the items that it is given is left out, since that belongs to the stages
+# before it, and so is the time between the items it hands on.
+def timed_stream(name, make_stream, items):
+    if not enabled:
+        return make_stream(items)
+
+    return _timed_stream(name, make_stream, items)
+
+def _timed_stream(name, make_stream, items):
+    with timer(name):
+        for item in make_stream(_timed_items(name, items)):
+            with _paused(name):
+                yield item
+
+# Yields the items with the timer of the given name stopped while each is got.
+def _timed_items(name, items):
+    items = iter(items)
+    while True:
+        with _paused(name):
+            item = next(items, _END)
+        if item is _END:
+            return
+        yield item
+
+# Returns everything measured so far as a dict that can be written as json.
+def report():
+    timers = dict((name, {'calls': calls, 'seconds': seconds})
+                  for name, (calls, seconds, _, _) in _timers.items())
+
+    histograms = {}
+    for name, histogram in _histograms.items():
+        buckets = histogram[:len(HISTOGRAM_BOUNDS) + 1]
+        total = sum(buckets)
+        labels = ['<=' + str(b) for b in HISTOGRAM_BOUNDS] + ['>' + str(HISTOGRAM_BOUNDS[-1])]
+        histograms[name] = {
+            'count': total,
+            'mean': histogram[-3] / total,
+            'min': histogram[-2],
+            'max': histogram[-1],
+            'buckets': dict((label, n) for label, n in zip(labels, buckets) if n)
+        }
+
+    rates = {}
+    for name, n in _counters.items():
+        stage = name.rsplit('.', 1)[0]
+        if stage in timers and timers[stage]['seconds'] > 0:
+            rates[name + '_per_second'] = n / timers[stage]['seconds']
+
+    return {
+        'timers': timers,
+        'counters': dict(_counters),
+        'histograms': histograms,
+        'rates': rates
+    }
+
+# Writes the report as json to filename. If a stage was profiled, then its
+# profile is written next to it with the extension .prof, which can be read
+# with pstats.
+def write_report(filename):
+    with open(filename, 'w') as f:
+        json.dump(report(), f, indent=2, sort_keys=True)
+
+    if _profiler is not None:
+        _profiler.dump_stats(filename + '.prof')
@@ -0,0 +1,105 @@
+################################################################################
+#
+# A sentiment backend that scores text in process from a lexicon of positive
+# and negative words, rather than asking a StanfordCoreNLP server. It is much
+# cruder than the server's model, but it needs no Java and no network, and it
+# scores a whole play in well under a second, which makes it useful for quick
+# exploratory runs and for checking the pipeline end to end.
+#
+# The score of a sentence is the number of positive words in it less the
+# number of negative words, where a word shortly after a negation counts the
+# other way. The sign of that is the sentence's score, on the same scale as the
+# scores of the server.
+#
+# The lexicon is either given as two word lists, in the format of the opinion
+# lexicon of Hu and Liu (one word per line, with ; for comments), or is the
+# opinion lexicon corpus of nltk.
+#
+################################################################################
+
+import hashlib
+
+import analysis
+
+class LexiconSentiment(object):
+    NEGATIONS = frozenset(['not', 'no', 'never', 'nor', 'none', 'nothing',
+                           'neither', 'nay', 'ne', 'cannot'])
+
+    # A word is negated if a negation is at most this many words before it.
+    NEGATION_WINDOW = 3
+
+    def __init__(self, positive, negative):
+        self.positive = frozenset(w.lower() for w in positive)
+        self.negative = frozenset(w.lower() for w in negative)
+
+        # The scores of different lexicons must not be cached together.
+        h = hashlib.sha1()
+        for words in (self.positive, self.negative):
+            h.update('\n'.join(sorted(words)))
+            h.update('\0')
+        self.config = {'backend': 'lexicon', 'lexicon': h.hexdigest()}
+
+    # Reads the lexicon from a file of positive words and one of negative words.
+    @classmethod
+    def from_files(cls, positive_filename, negative_filename):
+        return cls(_read_words(positive_filename), _read_words(negative_filename))
+
+    # Uses the opinion lexicon corpus of nltk, which has to have been
+    # downloaded with nltk.download('opinion_lexicon'). The corpus reader was
+    # only added in nltk 3.1.
+    @classmethod
+    def from_nltk(cls):
+        try:
+            from nltk.corpus import opinion_lexicon
+        except ImportError:
+            raise ImportError('The nltk opinion lexicon needs nltk 3.1 or later; '
+                              'upgrade nltk or give the files of positive and '
+                              'negative words instead.')
+
+        try:
+            return cls(opinion_lexicon.positive(), opinion_lexicon.negative())
+        except LookupError:
+            raise LookupError('The nltk opinion lexicon is not downloaded; run '
+                              "nltk.download('opinion_lexicon') first.")
+
+    # Scores a batch of units of text. A list is returned with a list of the
+    # scores of the sentences of each unit, in the same way as
+    # analysis.sentiment_units.
+    def score_units(self, units):
+        return [[self.score_sentence(s) for s in analysis.split_sentences(unit)]
+                for unit in units]
+
+    def score_sentence(self, sentence):
+        score = 0
+        negated_until = -1
+        for i, m in enumerate(analysis.TOKEN.finditer(sentence)):
+            word = m.group(0).lower()
+            if word in LexiconSentiment.NEGATIONS:
+                negated_until = i + LexiconSentiment.NEGATION_WINDOW
+                continue
+
+            if word in self.positive:
+                polarity = 1
+            elif word in self.negative:
+                polarity = -1
+            else:
+                continue
+
+            score += -polarity if i <= negated_until else polarity
+
+        if score > 0:
+            return 1
+        elif score < 0:
+            return -1
+        else:
+            return 0
+
+def _read_words(filename):
+    words = []
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith(';'):
+                words.append(line)
+
+    return words
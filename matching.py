@@ -0,0 +1,167 @@
+################################################################################
+#
+# Random matchings of characters into dyads. The characters that may be paired
+# up and the pairs that they may form make up a graph, and a set of dyads is a
+# matching of that graph, where no character is in more than one dyad. The
+# matchings drawn here are maximal, so no two characters that are left over
+# could still have been paired, and every maximal matching is equally likely.
+#
+# The graph is every pair of the characters but a few excluded ones, which
+# makes uniform matchings easy to draw by rejection. A matching is maximal just
+# when the characters it leaves over are all excluded from each other, and the
+# rest of the characters are then paired up completely. So a set of characters
+# to leave over is chosen, in proportion to the number of ways of pairing up
+# all of the others, the others are paired up at random, and the draw is tried
+# again if any pair is excluded. Every maximal matching comes out with the same
+# chance, and since few pairs are excluded, few draws are thrown away.
+#
+# If the excluded pairs are so many that draws would mostly be thrown away, a
+# matching is instead drawn by going through the pairs in a random order and
+# taking every pair whose characters are both still free. That matching is
+# still maximal, but not uniform, since matchings that many orders lead to come
+# up more often.
+#
+# With a seed the same matchings are drawn every time.
+#
+################################################################################
+
+import itertools
+
+import numpy
+
+class DyadGraph(object):
+    # A draw is thrown away at most this many times in a row before the
+    # matching is drawn greedily instead.
+    MAX_REJECTIONS = 1000
+
+    # The most sets of characters that can be left over that are looked for,
+    # beyond which matchings are always drawn greedily.
+    MAX_LEFTOVER_SETS = 10000
+
+    # The graph of every pair of the given names, except for the pairs in
+    # excluded. The pairs in excluded are not ordered, so neither (a, b) nor
+    # (b, a) is in the graph if either of them is excluded.
+    def __init__(self, names, excluded=()):
+        self.names = list(names)
+        n = len(self.names)
+
+        excluded = set(excluded)
+        self.allowed = numpy.ones((n, n), dtype=bool)
+        numpy.fill_diagonal(self.allowed, False)
+        for i, j in itertools.combinations(range(n), 2):
+            if (self.names[i], self.names[j]) in excluded or \
+               (self.names[j], self.names[i]) in excluded:
+                self.allowed[i, j] = self.allowed[j, i] = False
+
+        edges = [(i, j) for i, j in itertools.combinations(range(n), 2)
+                 if self.allowed[i, j]]
+        self.edges = numpy.array(edges, dtype=numpy.intp).reshape(-1, 2)
+
+        self._leftovers, self._weights = self._leftover_sets()
+
+    def __len__(self):
+        return len(self.edges)
+
+    # Draws a random maximal matching and returns it as a list of dyads of
+    # names. Which character of a dyad comes first is also random. The random
+    # choices come from rng, which is numpy's global random state unless a
+    # RandomState is given.
+    def sample(self, rng=numpy.random):
+        return [(self.names[i], self.names[j]) for i, j in self.sample_indices(rng)]
+
+    # The same as sample, but the matching is returned as an array with a row
+    # of name indexes for each dyad.
+    def sample_indices(self, rng=numpy.random):
+        if len(self.edges) == 0:
+            return numpy.empty((0, 2), dtype=numpy.intp)
+
+        if self._leftovers is not None:
+            n = len(self.names)
+            for _ in range(DyadGraph.MAX_REJECTIONS):
+                leftover = self._leftovers[rng.choice(len(self._leftovers), p=self._weights)]
+                paired = numpy.setdiff1d(numpy.arange(n), leftover)
+                order = paired[rng.permutation(len(paired))]
+                matching = order.reshape(-1, 2)
+                if self.allowed[matching[:, 0], matching[:, 1]].all():
+                    return matching
+
+        return self._sample_greedy(rng)
+
+    # Draws count random maximal matchings, in the form of sample_indices. The
+    # matchings only depend on the seed, and a seed of None draws from numpy's
+    # global random state.
+    def sample_many(self, count, seed=None):
+        rng = numpy.random if seed is None else numpy.random.RandomState(seed)
+
+        return [self.sample_indices(rng) for _ in range(count)]
+
+    # Whether the dyads of names, such as from sample, are a maximal matching
+    # of the graph: every dyad is a pair of the graph, no character is in two
+    # of them, and no two of the characters left over could still be paired.
+    def is_maximal_matching(self, dyads):
+        ids = dict((name, i) for i, name in enumerate(self.names))
+        free = numpy.ones(len(self.names), dtype=bool)
+        for a, b in dyads:
+            i = ids.get(a)
+            j = ids.get(b)
+            if i is None or j is None or not self.allowed[i, j] or \
+               not free[i] or not free[j]:
+                return False
+            free[i] = free[j] = False
+
+        return not self.allowed[numpy.ix_(free, free)].any()
+
+    def _sample_greedy(self, rng):
+        free = numpy.ones(len(self.names), dtype=bool)
+        chosen = []
+        for i, j in self.edges[rng.permutation(len(self.edges))].tolist():
+            if free[i] and free[j]:
+                free[i] = free[j] = False
+                chosen.append((i, j))
+
+        matching = numpy.array(chosen, dtype=numpy.intp)
+        flip = rng.randint(2, size=len(matching)).astype(bool)
+        matching[flip] = matching[flip, ::-1]
+
+        return matching
+
+    # Returns the sets of characters that a maximal matching can leave over,
+    # as arrays of name indexes, along with the chance of choosing each. A set
+    # can be left over if all of its characters are excluded from each other
+    # and an even number of characters are left to pair up. Its chance is in
+    # proportion to the number of ways of pairing those up, which is
+    # (m - 1)(m - 3)...1 for m characters. Returns (None, None) if there are
+    # too many sets.
+    def _leftover_sets(self):
+        n = len(self.names)
+        excluded = ~self.allowed
+        numpy.fill_diagonal(excluded, False)
+
+        sets = []
+        stack = [((), range(n))]
+        while stack:
+            members, candidates = stack.pop()
+            sets.append(members)
+            if len(sets) > DyadGraph.MAX_LEFTOVER_SETS:
+                return None, None
+
+            for k, c in enumerate(candidates):
+                stack.append((members + (c,),
+                              [d for d in candidates[k + 1:] if excluded[c, d]]))
+
+        sets = [s for s in sets if (n - len(s)) % 2 == 0]
+        if not sets:
+            return None, None
+
+        # The weights are taken relative to the smallest sets, so that they
+        # never overflow.
+        smallest = min(len(s) for s in sets)
+        weights = []
+        for s in sets:
+            weight = 1.0
+            for m in range(n - len(s) + 1, n - smallest, 2):
+                weight /= m
+            weights.append(weight)
+
+        weights = numpy.array(weights)
+        return [numpy.array(s, dtype=numpy.intp) for s in sets], weights / weights.sum()
@@ -0,0 +1,184 @@
+################################################################################
+#
+# A permutation test of the hostile dyads of a play against random non hostile
+# dyads. main.py compares the hostile dyads with a single random matching of
+# the other characters, which is a noisy comparison. Here thousands of random
+# matchings are drawn instead, and the same statistics are computed for each of
+# them to give an empirical null distribution for the hostile dyads.
+#
+# The sentiment of every line that any dyad could use is scored once, as a
+# count of sentences and of positive sentences per line. After that each
+# matching is only a sum over its lines. The counts are summed per ordered pair
+# of characters with a sparse matrix from lines to pairs, and then for all of
+# the matchings at once with a sparse matrix from pairs to matchings. So
+# drawing more matchings never makes more requests to the server.
+#
+# Since each line is scored on its own, a sentence that runs over the end of a
+# line is split where main.py would score it whole, so the statistics can be
+# slightly different from those of main.py.
+#
+#   python permutation.py PLAY ANNOTATION_KEY [matchings] [seed]
+#
+################################################################################
+
+from __future__ import division
+
+from collections import namedtuple
+import itertools
+import sys
+
+import numpy
+from scipy import sparse
+
+import analysis
+from corenlp import CoreNLPClient
+import dyads
+import playcache
+
+DEFAULT_NUM_MATCHINGS = 5000
+
+# The statistics that are tested, in the order of the arrays of a
+# PermutationTest. They are the percent of positive sentences of the betrayers
+# and of the victims, and the betrayer's percent less the victim's.
+STATISTICS = ('betrayer', 'victim', 'difference')
+
+# The result of a test. observed has the value of each statistic for the
+# hostile dyads, null has a row with the value of each statistic for each
+# random matching, and p_values has the two sided p-value of each statistic.
+PermutationTest = namedtuple('PermutationTest', ['observed', 'null', 'p_values'])
+
+# Runs the permutation test on the hostile dyads of the play, which are given
+# in the same form as read_annotation_key returns. Each random matching is
+# drawn from the characters that can be non hostile dyads, and only counts the
+# lines that do not belong to a hostile dyad, just as the non hostile dyads of
+# main.py do. The matchings only depend on the seed, and a seed of None draws
+# from numpy's global random state.
+def permutation_test(play, hostile_dyads, nlp, cache=None,
+                     num_matchings=DEFAULT_NUM_MATCHINGS, seed=None,
+                     candidates=None):
+    hostile = dyads.collect_dyad_positions(play, hostile_dyads, [], candidates)[:2]
+    hostile_positions = set(hostile[0]) | set(hostile[1])
+
+    graph = dyads.non_hostile_graph(play, hostile_dyads)
+    n = len(graph.names)
+
+    # Each row of the line matrix is a line, with a one in the column of the
+    # ordered pair of (speaker, listener) for each listener it is said to.
+    rows = []
+    cols = []
+    positions = []
+    row_of = {}
+    for i, j in itertools.permutations(range(n), 2):
+        for position in play.line_positions_between(graph.names[i], graph.names[j]):
+            if position in hostile_positions:
+                continue
+
+            if position not in row_of:
+                row_of[position] = len(positions)
+                positions.append(position)
+            rows.append(row_of[position])
+            cols.append(i * n + j)
+
+    lines = sparse.csr_matrix((numpy.ones(len(rows)), (rows, cols)),
+                              shape=(len(positions), n * n))
+
+    # Every line that is scored is scored in one call, so the batches of the
+    # hostile lines and the matching lines are shared.
+    scored = sorted(hostile_positions) + positions
+    counts = _line_counts(play, scored, nlp, cache)
+    hostile_counts = dict(zip(scored, counts))
+    line_counts = counts[len(hostile_positions):]
+
+    observed = _statistics(numpy.array([[sum(hostile_counts[p][k] for p in side)
+                                         for side in hostile]
+                                        for k in range(2)], dtype=float))
+
+    # The lines only matter through the ordered pair that they are said
+    # between, so they are summed into counts per pair first.
+    pair_counts = lines.T.dot(line_counts)
+
+    # A matching is a pair of columns, the ordered pairs of its betrayers and
+    # of its victims. A character is in at most one dyad of a matching, so a
+    # line, which has a single speaker, is counted at most once by a matching.
+    matchings = graph.sample_many(num_matchings, seed)
+    cols = []
+    rows = []
+    for m, matching in enumerate(matchings):
+        betrayers = matching[:, 0] * n + matching[:, 1]
+        victims = matching[:, 1] * n + matching[:, 0]
+        rows.extend(betrayers.tolist())
+        cols.extend([2 * m] * len(matching))
+        rows.extend(victims.tolist())
+        cols.extend([2 * m + 1] * len(matching))
+
+    pairs = sparse.csc_matrix((numpy.ones(len(rows)), (rows, cols)),
+                              shape=(n * n, 2 * num_matchings))
+
+    # The sentences and the positive sentences of each group of each matching,
+    # arranged the same way as the counts of the hostile dyads.
+    sums = numpy.asarray(pairs.T.dot(pair_counts))
+    null = _statistics(sums.reshape(num_matchings, 2, 2).transpose(2, 1, 0)).T
+
+    return PermutationTest(observed, null, p_values(observed, null))
+
+# Returns the two sided p-value of each observed statistic from its null
+# distribution, which has a row per sample. The observed value counts as one
+# of the samples, so a p-value is never zero.
+def p_values(observed, null):
+    lower = (numpy.sum(null <= observed, axis=0) + 1) / (len(null) + 1)
+    upper = (numpy.sum(null >= observed, axis=0) + 1) / (len(null) + 1)
+
+    return numpy.minimum(1, 2 * numpy.minimum(lower, upper))
+
+# Returns an array with a row for each of the given line positions, of the
+# number of sentences in the line and the number of those that are positive.
+def _line_counts(play, positions, nlp, cache):
+    scores = analysis.sentiment_units(nlp, [play.atoms[p].content for p in positions],
+                                      cache=cache)
+
+    return numpy.array([(len(s), sum(v > 0 for v in s)) for s in scores],
+                       dtype=float).reshape(-1, 2)
+
+# Computes the statistics from the sentence counts and positive sentence
+# counts, of the betrayers and victims. counts has the sentence counts as its
+# first row and the positive counts as its second, with a column each for the
+# betrayers and victims, and any further axes are kept. A group without any
+# sentences is taken to have no positive sentences, as in main.py.
+def _statistics(counts):
+    sentences, positive = counts[0], counts[1]
+    percents = numpy.where(sentences > 0, positive / numpy.maximum(sentences, 1), 0)
+
+    return numpy.array([percents[0], percents[1], percents[0] - percents[1]])
+
+################################################################################
+#
+# Main script.
+#
+################################################################################
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        raise TypeError('Illegal number of arguments.')
+
+    play_filename = sys.argv[1]
+    ann_key_filename = sys.argv[2]
+    num_matchings = int(sys.argv[3]) if len(sys.argv) >= 4 else DEFAULT_NUM_MATCHINGS
+    seed = int(sys.argv[4]) if len(sys.argv) >= 5 else None
+
+    p = playcache.load_play(play_filename)
+    nlp = CoreNLPClient()
+    sentiment_cache = analysis.SentimentCache()
+
+    hostile_dyads = dyads.read_annotation_key(ann_key_filename)
+    test = permutation_test(p, hostile_dyads, nlp, sentiment_cache,
+                            num_matchings, seed)
+
+    print 'Permutation test over ' + str(num_matchings) + ' random matchings'
+    for k, name in enumerate(['Betrayer percent positive',
+                              'Victim percent positive',
+                              'Betrayer less victim percent positive']):
+        low, high = numpy.percentile(test.null[:, k], [2.5, 97.5])
+        print name + ': ' + str(test.observed[k])
+        print name + ' null mean: ' + str(test.null[:, k].mean())
+        print name + ' null 95% range: ' + str((low, high))
+        print name + ' p-value: ' + str(test.p_values[k])
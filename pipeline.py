@@ -0,0 +1,143 @@
+################################################################################
+#
+# The dyad analysis of main.py as a pipeline of streams rather than a series of
+# batch phases. The atoms of a play go through a DyadRouter one at a time, the
+# dialogue of each group is split into sentences as its lines come in, the
+# sentences go on to the sentiment backend in batches, and the scores are
+# gathered into a GroupAccumulator for each group. The dialogue of a group is
+# never put together into one string, and only the scores of its sentences and
+# the positions of its lines are kept.
+#
+# Each stage pulls from the one before it, and the sentiment client only takes
+# another request once it has room for one. So the atoms are only routed as
+# quickly as the server keeps up with them, and what waits between the stages
+# is bounded: a request's worth of sentences for each group, a chunk of
+# sentences to look up in the cache, and the requests in flight. The first
+# request goes out as soon as a group has enough sentences for it, while the
+# rest of the play is still being routed, or with a lazy Play, still parsed.
+#
+# The sentences of each group are the same as those of dyads.analyze_groups,
+# and so are the statistics. Only the bootstrap has to wait for the whole play,
+# since it resamples all of the sentences of a group.
+#
+################################################################################
+
+import analysis
+import dyads
+import instrument
+
+# Gathers a group of dialogue as its lines are routed and its sentences are
+# scored. The positions of its lines and the number of words are kept as the
+# lines are added, and the scores of each sentence are kept in the order of
+# the sentences, no matter the order they come in.
+class GroupAccumulator(object):
+    def __init__(self):
+        self.positions = []
+        self.scores = []
+        self._spaces = 0
+        self._splitter = analysis.SentenceSplitter()
+
+    # Adds the line at the position in the play to the group, and returns the
+    # sentences of the dialogue that are now known to be over.
+    def add_line(self, position, content):
+        self.positions.append(position)
+        self._spaces += content.count(' ')
+
+        return self._splitter.feed(content)
+
+    # Returns the sentences that are left once all of the lines are added.
+    def close(self):
+        return self._splitter.close()
+
+    def set_scores(self, index, scores):
+        if index >= len(self.scores):
+            self.scores.extend([None] * (index + 1 - len(self.scores)))
+        self.scores[index] = scores
+
+    # The number of words of the dialogue, counted the same way as
+    # group_statistics counts them in the lines joined with spaces.
+    @property
+    def words(self):
+        return self._spaces + max(len(self.positions), 1)
+
+    def sentiments(self):
+        return [score for scores in self.scores for score in scores]
+
+# Routes the atoms to their groups and yields (group, sentence) for the
+# sentences of the dialogue of each group, in order within each group. The
+# groups are numbered in the order of dyads.GROUPS, and accumulators has a
+# GroupAccumulator for each. The lines of the groups in skip are passed over.
+def route_sentences(atoms, router, accumulators, skip=()):
+    routed = 0
+    for position, atom in enumerate(atoms):
+        routed += 1
+        for group in router.route(atom):
+            if group in skip:
+                continue
+
+            for sentence in accumulators[group].add_line(position, atom.content):
+                yield group, sentence
+
+    for group, accumulator in enumerate(accumulators):
+        for sentence in accumulator.close():
+            yield group, sentence
+
+    instrument.count('dyads.atoms_routed', routed)
+    instrument.count('dyads.match_checks', router.checks)
+
+# Returns the GroupStats of each of the groups of the dyads, from the atoms of
+# a play in order, such as from Play.iter_atoms. The results are the same as
+# collecting the positions with collect_dyad_positions and giving them to
+# analyze_groups, and so are the arguments, including the seed of each group.
+#
+# A group that is found in the RunState given as state is not bootstrapped
+# again. If the positions of the lines of the groups are also given, as found
+# by collect_dyad_positions, then the groups in the state are known before the
+# stream starts, and their lines are not scored at all. Otherwise they are
+# only known once the whole play has been routed, and their sentences are
+# still scored, mostly from the sentiment cache.
+def analyze_stream(atoms, hostile_dyads, non_hostile_dyads, nlp, cache=None,
+                   state=None, positions=None, batcher=None,
+                   num_samples=dyads.BOOTSTRAP_NUM_SAMPLES,
+                   seed=dyads.BOOTSTRAP_SEED, workers=dyads.BOOTSTRAP_WORKERS,
+                   pool=None):
+    with instrument.timer('pipeline'):
+        params = [(analysis.backend_config(nlp), num_samples,
+                   dyads.group_seed(seed, i), workers) for i in range(len(dyads.GROUPS))]
+
+        stored = {}
+        if state is not None and positions is not None:
+            for i, (group, lines) in enumerate(zip(dyads.GROUPS, positions)):
+                group_stats = state.group_stats(group, lines, params[i])
+                if group_stats is not None:
+                    stored[i] = dyads.GroupStats(*group_stats)
+
+        router = dyads.DyadRouter(hostile_dyads, non_hostile_dyads)
+        accumulators = [GroupAccumulator() for _ in dyads.GROUPS]
+
+        sentences = route_sentences(atoms, router, accumulators, stored)
+        for group, i, scores in analysis.sentiment_stream(nlp, sentences, batcher, cache):
+            accumulators[group].set_scores(i, scores)
+
+        stats = []
+        for i, (group, accumulator) in enumerate(zip(dyads.GROUPS, accumulators)):
+            if i in stored:
+                stats.append(stored[i])
+                continue
+
+            group_stats = None
+            if state is not None:
+                group_stats = state.group_stats(group, accumulator.positions, params[i])
+
+            if group_stats is not None:
+                stats.append(dyads.GroupStats(*group_stats))
+                continue
+
+            stats.append(dyads.sentence_statistics(accumulator.sentiments(),
+                                                   accumulator.words,
+                                                   num_samples, dyads.group_seed(seed, i),
+                                                   workers, pool))
+            if state is not None:
+                state.set_group_stats(group, accumulator.positions, params[i], stats[-1])
+
+        return stats
@@ -0,0 +1,286 @@
+################################################################################
+#
+# A cache of parsed plays so that the same Folger text does not have to be
+# parsed again on every run. A parsed Play is stored in a compact binary file
+# that is keyed on a hash of the play's text and of the parser itself, so that
+# editing either the play or shakespeare.py invalidates the entry without any
+# bookkeeping.
+#
+# The file is a small header followed by columns of fixed width integers, one
+# entry per atom, and an interned string table that every piece of text in the
+# play is stored in exactly once. The columns are read back through a memory
+# map, so loading a play does not need to copy the file before building atoms.
+#
+################################################################################
+
+import hashlib
+import inspect
+import itertools
+import json
+import os
+import struct
+import tempfile
+
+import numpy
+
+import instrument
+import shakespeare
+from shakespeare import (LINE_TYPES, STAGE_NOTE_TYPES, Annotation, AtomStore,
+                         Audience, Character, CharacterInfo, Line, NameTable,
+                         Play, StageNote)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'shakespeare')
+
+FORMAT_VERSION = 1
+MAGIC = 'SHKP'
+PREAMBLE = struct.Struct('<4sII')
+ALIGNMENT = 8
+
+# The kind column tells which atom type each row is.
+STAGE_NOTE_KIND = 0
+ANNOTATION_KIND = 1
+LINE_KIND = 2
+
+# The name and dtype of each column in the order they are written. The person
+# column is the speaker of a Line or the context of a StageNote, and the
+# audience column indexes into the table of distinct audiences.
+ATOM_COLUMNS = [
+    ('kind', numpy.uint8),
+    ('act', numpy.uint16),
+    ('scene', numpy.uint16),
+    ('num', numpy.uint32),
+    ('content', numpy.int32),
+    ('person', numpy.int32),
+    ('audience', numpy.int32)
+]
+
+# Stand in for None in any column of string ids.
+NO_STRING = -1
+
+_parser_digest = None
+
+# Returns the parsed Play for the given filename. If the play has been parsed
+# before by the same parser, then it is loaded from the cache in cache_dir.
+# Otherwise the play is parsed and saved to the cache for next time.
+#
+# If compact is set, then the play is given with its atoms in an AtomStore, as
+# with the compact option of Play. A play that is not cached is parsed by the
+# given number of worker processes, as with the workers option of Play.
+def load_play(filename, cache_dir=DEFAULT_CACHE_DIR, compact=False, workers=1):
+    path = os.path.join(cache_dir, cache_key(filename) + '.play')
+
+    if os.path.exists(path):
+        try:
+            with instrument.timer('play.cache_read'):
+                play = read_play(path, filename, compact)
+            instrument.count('play.cache_hits')
+            return play
+        except (ValueError, IOError):
+            # A cache entry that can not be read is no worse than a missing
+            # one, it simply gets written again below.
+            pass
+
+    instrument.count('play.cache_misses')
+    play = Play(filename, compact=compact, workers=workers)
+    try:
+        with instrument.timer('play.cache_write'):
+            write_play(play, path)
+    except (IOError, OSError):
+        # A cache that can not be written to, such as one on a read only or
+        # full disk, only means the play is parsed again next time.
+        pass
+
+    return play
+
+# The cache key for a play is the hash of the contents of its file, along with
+# the hash of the parser source and the cache format. That way any change to
+# how plays are parsed or stored misses the cache.
+def cache_key(filename):
+    h = hashlib.sha1()
+    h.update(_get_parser_digest())
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), ''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+def _get_parser_digest():
+    global _parser_digest
+
+    if _parser_digest is None:
+        h = hashlib.sha1()
+        h.update(str(FORMAT_VERSION))
+        with open(inspect.getsourcefile(shakespeare), 'rb') as f:
+            h.update(f.read())
+        _parser_digest = h.digest()
+
+    return _parser_digest
+
+# Writes the given play out to path in the cache format. The file is written
+# to a temporary name first and then moved into place so that a reader never
+# sees a partially written entry.
+def write_play(play, path):
+    strings = _StringTable()
+    audiences = {}
+    audience_members = []
+    audience_offsets = [0]
+
+    columns = dict((name, []) for name, _ in ATOM_COLUMNS)
+    for atom in play.atoms:
+        person = NO_STRING
+        audience = NO_STRING
+        if isinstance(atom, LINE_TYPES):
+            kind = LINE_KIND
+            person = strings.intern(atom.speaker)
+
+            key = frozenset(atom.audience)
+            if key not in audiences:
+                audiences[key] = len(audiences)
+                audience_members.extend(sorted(strings.intern(c) for c in key))
+                audience_offsets.append(len(audience_members))
+            audience = audiences[key]
+        elif isinstance(atom, STAGE_NOTE_TYPES):
+            kind = STAGE_NOTE_KIND
+            person = strings.intern(atom.context)
+        else:
+            kind = ANNOTATION_KIND
+
+        columns['kind'].append(kind)
+        columns['act'].append(atom.act)
+        columns['scene'].append(atom.scene)
+        columns['num'].append(atom.num)
+        columns['content'].append(strings.intern(atom.content))
+        columns['person'].append(person)
+        columns['audience'].append(audience)
+
+    header = {
+        'title': strings.intern(play.title),
+        'characters': [map(strings.intern, c) for c in play.characters],
+        'line_counts': [(strings.intern(name), info.line_count)
+                        for name, info in play.character_info.items()]
+    }
+
+    arrays = [(name, numpy.array(columns[name], dtype=dtype))
+              for name, dtype in ATOM_COLUMNS]
+    arrays.append(('audience_offsets', numpy.array(audience_offsets, dtype=numpy.uint32)))
+    arrays.append(('audience_members', numpy.array(audience_members, dtype=numpy.int32)))
+    arrays.append(('string_offsets', numpy.array(strings.offsets, dtype=numpy.uint32)))
+    arrays.append(('string_data', numpy.frombuffer(''.join(strings.values), dtype=numpy.uint8)))
+
+    # The header records where each array starts relative to the end of the
+    # header, so the header has to be laid out before its size is known.
+    offset = 0
+    layout = []
+    for name, array in arrays:
+        layout.append((name, array.dtype.str, offset, len(array)))
+        offset = _align(offset + array.nbytes)
+    header['arrays'] = layout
+
+    encoded = json.dumps(header)
+    data_start = _align(PREAMBLE.size + len(encoded))
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(encoded)))
+            f.write(encoded)
+            for (name, array), (_, _, array_offset, _) in zip(arrays, layout):
+                f.seek(data_start + array_offset)
+                f.write(array.tobytes())
+        os.rename(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+# Reads a play that was written with write_play back into a Play. The filename
+# is only recorded on the play and is not read. If compact is set, then the
+# atoms are read straight into an AtomStore.
+def read_play(path, filename, compact=False):
+    data = numpy.memmap(path, dtype=numpy.uint8, mode='r')
+    if len(data) < PREAMBLE.size:
+        raise ValueError('Truncated play cache file: ' + path)
+
+    magic, version, header_size = PREAMBLE.unpack(data[:PREAMBLE.size].tobytes())
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError('Not a play cache file: ' + path)
+
+    header = json.loads(data[PREAMBLE.size:PREAMBLE.size + header_size].tobytes())
+    data_start = _align(PREAMBLE.size + header_size)
+
+    # A file that was cut short still has a header that describes all of it,
+    # so every array is checked to be all there.
+    arrays = {}
+    for name, dtype, offset, length in header['arrays']:
+        start = data_start + offset
+        dtype = numpy.dtype(str(dtype))
+        arrays[name] = data[start:start + length * dtype.itemsize].view(dtype)
+        if len(arrays[name]) != length:
+            raise ValueError('Truncated play cache file: ' + path)
+
+    string_offsets = arrays['string_offsets'].tolist()
+    if string_offsets[-1] != len(arrays['string_data']):
+        raise ValueError('Damaged play cache file: ' + path)
+    string_data = arrays['string_data'].tobytes()
+    strings = [string_data[string_offsets[i]:string_offsets[i + 1]]
+               for i in range(len(string_offsets) - 1)]
+
+    # NO_STRING is -1, so None at the end of the list looks up as None.
+    strings.append(None)
+
+    characters = [Character(*[strings[i] for i in c]) for c in header['characters']]
+    character_info = dict((strings[name], CharacterInfo(count))
+                          for name, count in header['line_counts'])
+
+    # Every line with the same audience shares one Audience.
+    names = NameTable(c.short or c.name for c in characters)
+    audience_offsets = arrays['audience_offsets'].tolist()
+    audience_members = arrays['audience_members'].tolist()
+    audiences = []
+    for i in range(len(audience_offsets) - 1):
+        members = audience_members[audience_offsets[i]:audience_offsets[i + 1]]
+        audiences.append(Audience(names, names.mask(strings[c] for c in members)))
+
+    rows = itertools.izip(*[arrays[name].tolist() for name, _ in ATOM_COLUMNS])
+    atoms = _iter_atoms(rows, strings, audiences)
+    atoms = AtomStore(atoms) if compact else list(atoms)
+
+    return Play.from_parts(filename, strings[header['title']], characters,
+                           character_info, atoms, names)
+
+def _iter_atoms(rows, strings, audiences):
+    for kind, act, scene, num, content, person, audience in rows:
+        if kind == LINE_KIND:
+            yield Line(act, scene, num, strings[content], strings[person],
+                       audiences[audience])
+        elif kind == STAGE_NOTE_KIND:
+            yield StageNote(act, scene, num, strings[content], strings[person])
+        else:
+            yield Annotation(act, scene, num, strings[content])
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+# Interns strings to consecutive ids, and keeps the data needed to write them
+# out as one contiguous buffer with offsets. None is given the NO_STRING id.
+class _StringTable(object):
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+        self.offsets = [0]
+
+    def intern(self, s):
+        if s is None:
+            return NO_STRING
+
+        try:
+            return self.ids[s]
+        except KeyError:
+            i = len(self.values)
+            self.ids[s] = i
+            self.values.append(s)
+            self.offsets.append(self.offsets[-1] + len(s))
+            return i
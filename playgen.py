@@ -0,0 +1,215 @@
+################################################################################
+#
+# Generates synthetic plays in the Folger text format, along with annotation
+# keys for them, to measure the pipeline on plays of any size. The text means
+# nothing, but it has everything the parser has to deal with: act and scene
+# headers with padding, a character listing with short names, speeches that
+# run over several lines, stage notes inline, on their own line, and over
+# several lines, entrances and exits that move the audience around, and the
+# {..._HOSTILE_..._BEGIN} annotations of the hostile dyads.
+#
+# The size of a play is given as a PlaySpec. KING_LEAR is about the size of
+# King Lear, and scaled multiplies the number of scenes of a spec, so that for
+# example scaled(KING_LEAR, 100) is a play 100 times as long.
+#
+#   python playgen.py OUTPUT [scale] [seed]
+#
+# writes the play to OUTPUT and its annotation key next to it, with the
+# extension .key, so that a directory of generated plays can be given straight
+# to corpus.py.
+#
+################################################################################
+
+from collections import namedtuple
+import os
+import random
+import string
+import sys
+
+import fakecorenlp
+
+# The shape of a generated play. There are acts acts with scenes scenes each,
+# and each scene has speeches speeches of 1 to max_speech_lines lines. There
+# are characters characters, and hostile_dyads of the pairs of them are hostile
+# dyads with an annotation somewhere in the play. About stage_note_rate of the
+# speeches are followed by a stage note.
+PlaySpec = namedtuple('PlaySpec', ['title', 'acts', 'scenes', 'speeches',
+                                   'max_speech_lines', 'characters',
+                                   'hostile_dyads', 'stage_note_rate'])
+
+KING_LEAR = PlaySpec('King Lear', 5, 5, 30, 8, 20, 4, 0.2)
+
+# The characters are named after those of King Lear first, and then are made
+# up. Two of them are listed with a title, so that they have a short name.
+NAMES = ['LEAR', 'GONERIL', 'REGAN', 'CORDELIA', 'KENT', 'GLOUCESTER', 'EDGAR',
+         'EDMUND', 'OSWALD', 'FOOL', 'ALBANY', 'CORNWALL', 'CURAN', 'KNIGHT',
+         'HERALD', 'DOCTOR', 'CAPTAIN', 'MESSENGER']
+TITLED_NAMES = [('KING', 'FRANCE'), ('DUKE', 'BURGUNDY')]
+
+WORDS = ('thou art my lord what say you I your majesty more than words can '
+         'wield the matter nothing will come of speak again O sir here is '
+         'this night all our ').split()
+SENTIMENT_WORDS = sorted(fakecorenlp.POSITIVE_WORDS | fakecorenlp.NEGATIVE_WORDS)
+PUNCTUATION = ['.', '.', ',', '!', '?', ';', '']
+
+# Returns the spec with factor times as many scenes in each act.
+def scaled(spec, factor):
+    return spec._replace(scenes=max(1, int(round(spec.scenes * factor))))
+
+# Returns the names that the given number of characters are listed under, and
+# the names that they are spoken of by, which differ for titled characters.
+def character_names(count):
+    listed = []
+    for title, short in TITLED_NAMES[:count]:
+        listed.append((title + ' OF ' + short, short))
+
+    i = 0
+    while len(listed) < count:
+        if i < len(NAMES):
+            name = NAMES[i]
+        else:
+            name = 'LORD' + _letters(i - len(NAMES))
+        listed.append((name, name))
+        i += 1
+
+    return listed
+
+# Writes a play of the given spec to the file f. The random choices only depend
+# on the seed. The hostile dyads are returned as the lines of the annotation
+# key, each of which is a list of the annotation id, the betrayer, the victim,
+# and the second annotation id.
+def write_play(f, spec, seed=0):
+    r = random.Random(seed)
+    listed = character_names(spec.characters)
+    names = [short for _, short in listed]
+
+    f.write(spec.title + '\nby William Shakespeare\n\nCharacters in the Play\n')
+    f.write('=' * len('Characters in the Play') + '\n')
+    for name, short in listed:
+        if name == short:
+            f.write(name + ', a person\n')
+        else:
+            f.write(name + '\n')
+    f.write('\n')
+
+    # Each hostile dyad gets an annotation at a random speech of the play.
+    total_speeches = spec.acts * spec.scenes * spec.speeches
+    dyads = []
+    markers = {}
+    pairs = [(a, b) for a in names for b in names if a != b]
+    for k, (betrayer, victim) in enumerate(r.sample(pairs, min(spec.hostile_dyads, len(pairs)))):
+        dyads.append([str(2 * k + 1), betrayer, victim, str(2 * k + 2)])
+        markers[r.randrange(total_speeches)] = dyads[-1]
+
+    speech = 0
+    for act in range(1, spec.acts + 1):
+        f.write('ACT {}\n=====\n\n'.format(act))
+        for scene in range(1, spec.scenes + 1):
+            f.write('Scene {}\n=======\n'.format(scene))
+            on_stage = r.sample(names, min(len(names), r.randint(2, 5)))
+            f.write('[Enter {}.]\n'.format(_name_list([n.title() for n in on_stage])))
+
+            for _ in range(spec.speeches):
+                f.write('\n')
+                if speech in markers:
+                    ann = markers[speech]
+                    f.write('{{{}_HOSTILE_{}_BEGIN}}\n\n'.format(ann[0], ann[3]))
+                speech += 1
+
+                speaker = r.choice(on_stage)
+                f.write(speaker + '  ')
+                for _ in range(r.randint(1, spec.max_speech_lines)):
+                    f.write(_dialogue(r, names) + '\n')
+
+                if r.random() < spec.stage_note_rate:
+                    f.write(_stage_note(r, names, on_stage) + '\n')
+            f.write('\n')
+
+    return dyads
+
+# Writes a play of the given spec to filename and its annotation key to the
+# same name with the extension .key. Returns the filenames of both.
+def generate(filename, spec=KING_LEAR, seed=0):
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    with open(filename, 'w') as f:
+        dyads = write_play(f, spec, seed)
+
+    key_filename = os.path.splitext(filename)[0] + '.key'
+    with open(key_filename, 'w') as f:
+        for dyad in dyads:
+            f.write(', '.join(dyad) + '\n')
+
+    return filename, key_filename
+
+def _dialogue(r, names):
+    words = [r.choice(WORDS) for _ in range(r.randint(3, 9))]
+    if r.random() < 0.3:
+        words[r.randrange(len(words))] = r.choice(SENTIMENT_WORDS)
+
+    text = ' '.join(words)
+    text = text[0].upper() + text[1:] + r.choice(PUNCTUATION)
+
+    x = r.random()
+    if x < 0.04:
+        text += ' [He kneels.]'
+    elif x < 0.07:
+        text = '[To {}] {}'.format(r.choice(names).title(), text)
+
+    return text
+
+# Returns a stage note that moves characters on or off the stage, which is
+# kept up to date in on_stage. Some of the notes run over several lines.
+def _stage_note(r, names, on_stage):
+    x = r.random()
+    if x < 0.4:
+        enter = r.choice(names)
+        if enter not in on_stage:
+            on_stage.append(enter)
+        return '[Enter {}.]'.format(enter.title())
+    elif x < 0.7 and len(on_stage) > 2:
+        leave = on_stage.pop(r.randrange(len(on_stage)))
+        return '[{} exits.]'.format(leave.title())
+    elif x < 0.85 and len(on_stage) > 2:
+        leave = on_stage.pop(r.randrange(len(on_stage)))
+        enter = r.choice(names)
+        if enter not in on_stage:
+            on_stage.append(enter)
+        return '[{} exits,\nthe rest remaining,\nwhile Enter {}.]'.format(
+            leave.title(), enter.title())
+    else:
+        return '[{} draws {} sword.]'.format(r.choice(on_stage).title(),
+                                             r.choice(['his', 'her']))
+
+def _name_list(names):
+    if len(names) == 1:
+        return names[0]
+
+    return ', '.join(names[:-1]) + ', and ' + names[-1]
+
+def _letters(i):
+    letters = ''
+    i += 1
+    while i > 0:
+        i, rem = divmod(i - 1, 26)
+        letters = string.ascii_uppercase[rem] + letters
+
+    return letters
+
+################################################################################
+#
+# Main script.
+#
+################################################################################
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        raise TypeError('Illegal number of arguments.')
+
+    output = sys.argv[1]
+    scale = float(sys.argv[2]) if len(sys.argv) >= 3 else 1
+    seed = int(sys.argv[3]) if len(sys.argv) >= 4 else 0
+
+    generate(output, scaled(KING_LEAR, scale), seed)
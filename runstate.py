@@ -0,0 +1,122 @@
+################################################################################
+#
+# The state of the last analysis of a play, kept so that running the play
+# again with a different annotation key only redoes the work that the new key
+# changes. For each group of dialogue the state has the positions of the lines
+# that were collected for it, and the statistics that came out of them. A group
+# whose lines and bootstrap parameters are the same as last time is not scored
+# or bootstrapped again. The sentiment of the sentences of a group that did
+# change mostly comes from the sentiment cache, since most of its lines will
+# have been scored before.
+#
+# The state also keeps the positions of the hostility annotations, so finding
+# where each hostile dyad ends does not need a pass over the whole play, and
+# the non hostile dyads that were chosen, so that the non hostile groups do not
+# change just because the choice was made again.
+#
+# The state is stored next to the play cache, under the same key, so it is
+# thrown out whenever the play or the parser changes.
+#
+################################################################################
+
+import json
+import os
+import tempfile
+
+import playcache
+
+FORMAT_VERSION = 1
+
+class RunState(object):
+    # Loads the state at path, or starts an empty one if there is no state
+    # there or it can not be read.
+    def __init__(self, path):
+        self.path = path
+        self.candidates = None
+        self._non_hostile_dyads = None
+        self._groups = {}
+
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return
+
+        if data.get('version') != FORMAT_VERSION:
+            return
+
+        self.candidates = data['candidates']
+        if data['non_hostile_dyads'] is not None:
+            self._non_hostile_dyads = [tuple(_encode(c) for c in dyad)
+                                       for dyad in data['non_hostile_dyads']]
+        self._groups = data['groups']
+
+    # Returns the run state of the given play file from cache_dir.
+    @classmethod
+    def for_play(cls, filename, cache_dir=playcache.DEFAULT_CACHE_DIR):
+        return cls(os.path.join(cache_dir, playcache.cache_key(filename) + '.run'))
+
+    # Returns the non hostile dyads from the last run if they are still a
+    # maximal matching of graph, the DyadGraph of the pairs that can be non
+    # hostile dyads under the current key, and None otherwise. A dyad that has
+    # since become hostile breaks the matching, and so does a hostile dyad
+    # that was dropped from the key, if both of its characters were left over.
+    def non_hostile_dyads(self, graph):
+        if self._non_hostile_dyads is None or \
+           not graph.is_maximal_matching(self._non_hostile_dyads):
+            return None
+
+        return list(self._non_hostile_dyads)
+
+    def set_non_hostile_dyads(self, dyads):
+        self._non_hostile_dyads = [tuple(dyad) for dyad in dyads]
+
+    # Returns the stored statistics of the group as a list, if the group was
+    # last computed from the same line positions and parameters. Otherwise
+    # None is returned.
+    def group_stats(self, group, positions, params):
+        entry = self._groups.get(group)
+        if entry is None or entry['lines'] != list(positions) or \
+           entry['params'] != list(params):
+            return None
+
+        return entry['stats']
+
+    def set_group_stats(self, group, positions, params, stats):
+        self._groups[group] = {
+            'lines': list(positions),
+            'params': list(params),
+            'stats': [_plain(s) for s in stats]
+        }
+
+    # Writes the state back to its path. Like the play cache, the state is
+    # written to a temporary file first and then moved into place.
+    def save(self):
+        data = {
+            'version': FORMAT_VERSION,
+            'candidates': self.candidates,
+            'non_hostile_dyads': self._non_hostile_dyads,
+            'groups': self._groups
+        }
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory or '.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp_path, self.path)
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+
+    return value
+
+# The statistics may be numpy scalars, which json does not know about.
+def _plain(value):
+    if hasattr(value, 'item'):
+        return value.item()
+
+    return value
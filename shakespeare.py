@@ -7,11 +7,16 @@
 #
 ################################################################################
 
+from array import array
 from collections import namedtuple
+from itertools import izip
+import multiprocessing
 import re
 
 from recordclass import recordclass
 
+import instrument
+
 PlayAtom = namedtuple('PlayAtom', ['act', 'scene', 'num', 'content'])
 StageNote = namedtuple('StageNote', PlayAtom._fields + ('context',))
 Annotation = namedtuple('Annotation', PlayAtom._fields)
@@ -20,6 +25,432 @@ Line = namedtuple('Line', PlayAtom._fields + ('speaker', 'audience'))
 Character = namedtuple('Character', ['name', 'short', 'desc'])
 CharacterInfo = recordclass('CharacterInfo', ['line_count'])
 
+# Interns the names that appear in a play's audiences to small integer ids so
+# that an audience can be kept as a bitmask. Listed characters are given the
+# first ids, and any other name is given the next id the first time it is seen.
+class NameTable(object):
+    def __init__(self, names=()):
+        self.ids = {}
+        self.names = []
+
+        for name in names:
+            self.intern(name)
+
+    def intern(self, name):
+        try:
+            return self.ids[name]
+        except KeyError:
+            i = len(self.names)
+            self.ids[name] = i
+            self.names.append(name)
+            return i
+
+    # Returns the bitmask with a bit set for each of the given names.
+    def mask(self, names):
+        mask = 0
+        for name in names:
+            mask |= 1 << self.intern(name)
+
+        return mask
+
+    # Returns the bitmask with a bit set for each of the given names that is
+    # in the table, without adding the others, along with a list of those.
+    def find_mask(self, names):
+        mask = 0
+        unknown = []
+        for name in names:
+            i = self.ids.get(name)
+            if i is None:
+                unknown.append(name)
+            else:
+                mask |= 1 << i
+
+        return mask, unknown
+
+    # Returns the names whose bits are set in the given mask, in id order.
+    def names_of(self, mask):
+        names = []
+        i = 0
+        while mask:
+            if mask & 1:
+                names.append(self.names[i])
+            mask >>= 1
+            i += 1
+
+        return names
+
+# An immutable set of names stored as a bitmask over a play's NameTable. It
+# supports the read only parts of the set interface, and compares equal to a
+# set with the same names, so it can stand in for the sets that lines used to
+# carry. Since it can not change, consecutive lines with the same audience
+# share one Audience rather than each holding a copy.
+#
+# Names that are not in the table are never added to it, since the table is
+# shared by the whole play. A union, symmetric difference, or reflected
+# difference with such names gives a frozenset rather than an Audience.
+class Audience(object):
+    __slots__ = ('table', 'mask')
+
+    def __init__(self, table, mask=0):
+        self.table = table
+        self.mask = mask
+
+    def __contains__(self, name):
+        i = self.table.ids.get(name)
+        return i is not None and (self.mask >> i) & 1 == 1
+
+    # Membership by interned id rather than by name.
+    def has_id(self, i):
+        return (self.mask >> i) & 1 == 1
+
+    def __iter__(self):
+        return iter(self.table.names_of(self.mask))
+
+    def __len__(self):
+        return bin(self.mask).count('1')
+
+    def __nonzero__(self):
+        return self.mask != 0
+
+    def __or__(self, other):
+        mask, unknown = self._mask_of(other)
+        if unknown:
+            return frozenset(self).union(other)
+
+        return Audience(self.table, self.mask | mask)
+
+    def __and__(self, other):
+        return Audience(self.table, self.mask & self._mask_of(other)[0])
+
+    def __sub__(self, other):
+        return Audience(self.table, self.mask & ~self._mask_of(other)[0])
+
+    def __xor__(self, other):
+        mask, unknown = self._mask_of(other)
+        if unknown:
+            return frozenset(self).symmetric_difference(other)
+
+        return Audience(self.table, self.mask ^ mask)
+
+    # The reflected operators, for when a set is on the left.
+    __ror__ = __or__
+    __rand__ = __and__
+    __rxor__ = __xor__
+
+    def __rsub__(self, other):
+        mask, unknown = self._mask_of(other)
+        if unknown:
+            return frozenset(other).difference(self)
+
+        return Audience(self.table, mask & ~self.mask)
+
+    # The named methods take any iterables of names, as those of set do.
+    def union(self, *others):
+        return self | [name for other in others for name in other]
+
+    def intersection(self, *others):
+        result = self
+        for other in others:
+            result &= other
+
+        return result
+
+    def difference(self, *others):
+        return self - [name for other in others for name in other]
+
+    def symmetric_difference(self, other):
+        return self ^ list(other)
+
+    def isdisjoint(self, other):
+        return self.mask & self._mask_of(other)[0] == 0
+
+    def issubset(self, other):
+        return self.mask & ~self._mask_of(other)[0] == 0
+
+    def issuperset(self, other):
+        mask, unknown = self._mask_of(other)
+        return not unknown and mask & ~self.mask == 0
+
+    # As with set, the comparisons are subset and superset checks, and are only
+    # defined against other sets.
+    def __le__(self, other):
+        if not isinstance(other, (Audience, set, frozenset)):
+            return NotImplemented
+
+        return self.issubset(other)
+
+    def __lt__(self, other):
+        if not isinstance(other, (Audience, set, frozenset)):
+            return NotImplemented
+
+        return self.issubset(other) and len(self) < len(other)
+
+    def __ge__(self, other):
+        if not isinstance(other, (Audience, set, frozenset)):
+            return NotImplemented
+
+        return self.issuperset(other)
+
+    def __gt__(self, other):
+        if not isinstance(other, (Audience, set, frozenset)):
+            return NotImplemented
+
+        return self.issuperset(other) and len(self) > len(other)
+
+    def __eq__(self, other):
+        if isinstance(other, Audience) and other.table is self.table:
+            return self.mask == other.mask
+        elif isinstance(other, (Audience, set, frozenset)):
+            return set(self) == set(other)
+
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __hash__(self):
+        return hash(frozenset(self))
+
+    # The audience is immutable, so a copy is itself. This keeps code that
+    # copied the old audience sets working.
+    def copy(self):
+        return self
+
+    def __repr__(self):
+        return 'Audience({!r})'.format(set(self))
+
+    # Returns the mask of the names of other that are in the table, and a list
+    # of the names that are not.
+    def _mask_of(self, other):
+        if isinstance(other, Audience) and other.table is self.table:
+            return other.mask, []
+
+        return self.table.find_mask(other)
+
+# A compact store of a play's atoms, for keeping many plays in memory at once.
+# Rather than a tuple per atom, each field is kept in a column of fixed width
+# integers, the content of every atom is kept in one string, and speakers,
+# contexts and audiences are stored once each and referred to by id. It acts
+# like a list of atoms, but the atoms it hands out are views onto the columns,
+# with the same attributes as the Line, StageNote, and Annotation tuples.
+# Views compare equal to the tuples with the same fields.
+class AtomStore(object):
+    STAGE_NOTE_KIND = 0
+    ANNOTATION_KIND = 1
+    LINE_KIND = 2
+
+    NO_ID = -1
+
+    def __init__(self, atoms=()):
+        self._kinds = array('B')
+        self._acts = array('H')
+        self._scenes = array('H')
+        self._nums = array('i')
+        self._ends = array('l')
+        self._people = array('i')
+        self._audiences = array('i')
+
+        self._people_table = []
+        self._audience_table = []
+
+        self._text = ''
+        self.extend(atoms)
+
+    # Appends the atoms to the store. The text of the new atoms is joined onto
+    # the buffer once at the end.
+    def extend(self, atoms):
+        people = dict((p, i) for i, p in enumerate(self._people_table))
+        audiences = dict((_audience_key(a), i) for i, a in enumerate(self._audience_table))
+
+        # Lines share their audiences, so an audience only has to be looked up
+        # when it changes from the line before.
+        last_audience = None
+        audience_id = AtomStore.NO_ID
+
+        end = self._ends[-1] if self._ends else 0
+        texts = [self._text]
+        columns = (self._kinds.append, self._acts.append, self._scenes.append,
+                   self._nums.append, self._ends.append, self._people.append,
+                   self._audiences.append)
+        add_kind, add_act, add_scene, add_num, add_end, add_person, add_audience = columns
+        for atom in atoms:
+            if isinstance(atom, LINE_TYPES):
+                add_kind(AtomStore.LINE_KIND)
+                add_person(_intern(people, self._people_table, atom.speaker))
+
+                if atom.audience is not last_audience:
+                    last_audience = atom.audience
+                    audience_id = _intern(audiences, self._audience_table, last_audience,
+                                          _audience_key(last_audience))
+                add_audience(audience_id)
+            else:
+                if isinstance(atom, STAGE_NOTE_TYPES):
+                    add_kind(AtomStore.STAGE_NOTE_KIND)
+                    add_person(_intern(people, self._people_table, atom.context))
+                else:
+                    add_kind(AtomStore.ANNOTATION_KIND)
+                    add_person(AtomStore.NO_ID)
+                add_audience(AtomStore.NO_ID)
+
+            content = atom.content
+            end += len(content)
+            texts.append(content)
+
+            add_act(atom.act)
+            add_scene(atom.scene)
+            add_num(atom.num)
+            add_end(end)
+
+        self._text = ''.join(texts)
+
+    def __len__(self):
+        return len(self._kinds)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(len(self)))]
+
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('atom index out of range')
+
+        return _VIEW_TYPES[self._kinds[i]](self, i)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield _VIEW_TYPES[self._kinds[i]](self, i)
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def content(self, i):
+        return self._text[self._ends[i - 1] if i else 0:self._ends[i]]
+
+    def person(self, i):
+        person = self._people[i]
+        return None if person == AtomStore.NO_ID else self._people_table[person]
+
+    def audience(self, i):
+        return self._audience_table[self._audiences[i]]
+
+def _audience_key(audience):
+    if isinstance(audience, Audience):
+        return (id(audience.table), audience.mask)
+
+    return frozenset(audience)
+
+def _intern(ids, table, value, key=None):
+    key = value if key is None else key
+    try:
+        return ids[key]
+    except KeyError:
+        ids[key] = len(table)
+        table.append(value)
+        return ids[key]
+
+# The views of the atoms of an AtomStore. Each is only a reference to the
+# store and the position of its atom, and reads its fields from the store's
+# columns when they are asked for.
+class _AtomView(object):
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    @property
+    def act(self):
+        return self._store._acts[self._index]
+
+    @property
+    def scene(self):
+        return self._store._scenes[self._index]
+
+    @property
+    def num(self):
+        return self._store._nums[self._index]
+
+    @property
+    def content(self):
+        return self._store.content(self._index)
+
+    def __iter__(self):
+        return (getattr(self, field) for field in self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __eq__(self, other):
+        if isinstance(other, (tuple, _AtomView)):
+            return type(self)._tuple_type == _tuple_type_of(other) and \
+                   tuple(self) == tuple(other)
+
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return repr(self._tuple_type(*self))
+
+    def _astuple(self):
+        return self._tuple_type(*self)
+
+class LineView(_AtomView):
+    __slots__ = ()
+    _tuple_type = Line
+    _fields = Line._fields
+
+    @property
+    def speaker(self):
+        return self._store.person(self._index)
+
+    @property
+    def audience(self):
+        return self._store.audience(self._index)
+
+class StageNoteView(_AtomView):
+    __slots__ = ()
+    _tuple_type = StageNote
+    _fields = StageNote._fields
+
+    @property
+    def context(self):
+        return self._store.person(self._index)
+
+class AnnotationView(_AtomView):
+    __slots__ = ()
+    _tuple_type = Annotation
+    _fields = Annotation._fields
+
+def _tuple_type_of(atom):
+    return atom._tuple_type if isinstance(atom, _AtomView) else type(atom)
+
+_VIEW_TYPES = {
+    AtomStore.STAGE_NOTE_KIND: StageNoteView,
+    AtomStore.ANNOTATION_KIND: AnnotationView,
+    AtomStore.LINE_KIND: LineView
+}
+
+# The types that each kind of atom can have, whether it is a tuple or a view
+# from an AtomStore. Code that checks the kind of an atom should check against
+# these rather than against the tuple types.
+LINE_TYPES = (Line, LineView)
+STAGE_NOTE_TYPES = (StageNote, StageNoteView)
+ANNOTATION_TYPES = (Annotation, AnnotationView)
+
 class Play(object):
     ACT_HEADER = '^ACT (\d+)$'
     SCENE_HEADER = '^Scene (\d+)$'
@@ -29,45 +460,230 @@ class Play(object):
 
     ANNOTATION = '^\{(.+)\}$'
 
+    # The structural lines of the play (act and scene headers, padding, and
+    # blank lines) are recognized with one scan rather than a pattern each. Any
+    # line that does not match is a content line.
+    LINE_SCANNER = '^(?:ACT (?P<act>\d+)|Scene (?P<scene>\d+)|(?P<padding>=+)|(?P<blank>))$'
+
     CHARACTERS_SECTION_HEADER = 'Characters in the Play'
     CHARACTER_LISTING = '^(.+?)(, (.+))?$'
     CHARACTER_OF = ' OF '
 
     ENTER_VERBS = ['ENTER', 'ENTERS']
     EXIT_VERBS = ['EXIT', 'EXITS']
-    CONJUNCTIONS = '\, +AND +|\, *'
+    WORD = '[^,\s]+'
     SING_PRONOUNS = ['HE', 'SHE']
     PLURAL_PRONOUNS = ['THEY', 'ALL']
     NEG_MODIFIERS = ['BUT']
 
-    def __init__(self, filename):
-        with open(filename, 'r') as f:
-            self.raw_lines = map(lambda l: l.rstrip('\r\n'), f.readlines())
-            self.atoms = []
+    _LINE_SCANNER_RE = re.compile(LINE_SCANNER)
+    _STAGE_NOTES_RE = re.compile(STAGE_NOTES)
+    _CHARACTER_RE = re.compile(CHARACTER)
+    _PADDING_RE = re.compile(PADDING)
+    _ANNOTATION_RE = re.compile(ANNOTATION)
+    _CHARACTER_LISTING_RE = re.compile(CHARACTER_LISTING)
+    _WORD_RE = re.compile(WORD)
+
+    # The verbs are tried longest first, so that ENTERS is not mistaken for
+    # ENTER.
+    _ENTER_VERBS_BY_LENGTH = sorted(ENTER_VERBS, key=len, reverse=True)
+    _EXIT_VERBS_BY_LENGTH = sorted(EXIT_VERBS, key=len, reverse=True)
+    _SING_PRONOUNS = frozenset(SING_PRONOUNS)
+    _PLURAL_PRONOUNS = frozenset(PLURAL_PRONOUNS)
+    _NEG_MODIFIERS = frozenset(NEG_MODIFIERS)
+
+    # By default the whole play is read and parsed up front into atoms. If lazy
+    # is set, only the title and the character listing are read here, and the
+    # atoms are parsed from the file as they are pulled from iter_atoms. A lazy
+    # play does not keep its raw_lines or atoms, and its character_info line
+    # counts are built up as the atoms are yielded.
+    #
+    # If compact is set, then the atoms are kept in an AtomStore rather than a
+    # list, and the raw_lines are let go of once the play is parsed, which
+    # takes a fraction of the memory.
+    #
+    # If workers is more than one, then the acts are parsed in parallel by
+    # that many worker processes, which gives the same atoms as parsing them
+    # one after another.
+    def __init__(self, filename, lazy=False, compact=False, workers=1):
+        if lazy and compact:
+            raise ValueError('A lazy play has no atoms to keep compact.')
+        if lazy and workers > 1:
+            raise ValueError('A lazy play is parsed as it is read, not in parallel.')
+
+        self.filename = filename
+        self.lazy = lazy
+        self._indexes = None
+
+        if lazy:
+            self.raw_lines = None
+            self.atoms = None
+
+            with open(filename, 'r') as f:
+                lines = Play._stripped(f)
+
+                # The title is the first line of the file
+                self.title = next(lines)
+                self._parse_characters(lines)
+        else:
+            with open(filename, 'r') as f:
+                self.raw_lines = map(lambda l: l.rstrip('\r\n'), f.readlines())
+                self.atoms = []
+
+                # The title is the first line of the file
+                self.title = self.raw_lines[0]
+
+                with instrument.timer('play.parse'):
+                    self._parse_characters(self.raw_lines)
+                    if compact:
+                        self.atoms = AtomStore(self._iter_acts_with(workers))
+                    else:
+                        self._parse_acts(workers)
+
+            if compact:
+                self.raw_lines = None
+
+    # Builds a Play out of its already parsed parts, without reading or parsing
+    # the file. This is how plays are restored from somewhere other than the
+    # Folger text, such as the parse cache. If the audiences of the atoms were
+    # built over a NameTable, then that table should be given as names.
+    @classmethod
+    def from_parts(cls, filename, title, characters, character_info, atoms,
+                   names=None):
+        play = cls.__new__(cls)
+        play.filename = filename
+        play.lazy = False
+        play._indexes = None
+        play.raw_lines = None
+        play.title = title
+        play.characters = characters
+        play.character_info = character_info
+        play.names = names or NameTable(c.short or c.name for c in characters)
+        play.atoms = atoms
+        play._index_characters()
+
+        return play
+
+    # Moves the atoms of the play into an AtomStore and lets go of the raw
+    # lines, as if the play had been parsed with compact set.
+    def compact(self):
+        if self.lazy:
+            raise ValueError('A lazy play has no atoms to keep compact.')
+
+        if not isinstance(self.atoms, AtomStore):
+            self.atoms = AtomStore(self.atoms)
+        self.raw_lines = None
+
+    # Returns the interned id of the given character name, or None if the name
+    # has never been seen in the play. The id can be tested against an audience
+    # with Audience.has_id.
+    def character_id(self, name):
+        return self.names.ids.get(name)
 
-            # The title is the first line of the file
-            self.title = self.raw_lines[0]
+    # Returns the Lines spoken by the given speaker in order.
+    def lines_by(self, speaker):
+        return [self.atoms[i] for i in self.line_positions_by(speaker)]
 
-            self._parse_characters()
-            self._parse_acts()
+    # Returns the Lines spoken by speaker while listener was in the audience, in
+    # order.
+    def lines_between(self, speaker, listener):
+        return [self.atoms[i] for i in self.line_positions_between(speaker, listener)]
+
+    # Returns the atoms of the given scene of the given act, or an empty list if
+    # the play has no such scene.
+    def scene(self, act, scene):
+        start, end = self._get_indexes()[2].get((act, scene), (0, 0))
+        return self.atoms[start:end]
+
+    # The same as lines_by, but returns the positions of the lines in atoms. The
+    # returned list is the index itself and should not be modified.
+    def line_positions_by(self, speaker):
+        return self._get_indexes()[0].get(speaker, [])
+
+    # The same as lines_between, but returns the positions of the lines in
+    # atoms. The returned list is the index itself and should not be modified.
+    def line_positions_between(self, speaker, listener):
+        return self._get_indexes()[1].get((speaker, listener), [])
+
+    # The indexes behind the query methods are built from the atoms in a single
+    # pass the first time any of them is needed. They are a map from speaker to
+    # line positions, a map from (speaker, audience member) to line positions,
+    # and a map from (act, scene) to the range of the scene's atoms.
+    def _get_indexes(self):
+        if self._indexes is None:
+            if self.lazy:
+                raise ValueError('A lazy play has no atoms to index.')
+
+            by_speaker = {}
+            by_dyad = {}
+            scenes = {}
+
+            # Lines share their Audience objects, so the members of each one
+            # only have to be listed once.
+            members = {}
+            for i, atom in enumerate(self.atoms):
+                key = (atom.act, atom.scene)
+                if key in scenes:
+                    scenes[key][1] = i + 1
+                else:
+                    scenes[key] = [i, i + 1]
+
+                if isinstance(atom, LINE_TYPES):
+                    by_speaker.setdefault(atom.speaker, []).append(i)
+
+                    aud_id = id(atom.audience)
+                    if aud_id not in members:
+                        members[aud_id] = list(atom.audience)
+                    for listener in members[aud_id]:
+                        by_dyad.setdefault((atom.speaker, listener), []).append(i)
+
+            scenes = dict((key, tuple(r)) for key, r in scenes.items())
+            self._indexes = (by_speaker, by_dyad, scenes)
+
+        return self._indexes
+
+    # Returns an iterator over the atoms of the play in order. For a lazy play
+    # the file is read line by line and each atom is yielded as soon as it is
+    # recognized, so consumers can start before the play is done parsing. Each
+    # call on a lazy play parses the file again.
+    def iter_atoms(self):
+        if not self.lazy:
+            return iter(self.atoms)
+
+        return self._iter_file_atoms()
+
+    def _iter_file_atoms(self):
+        for info in self.character_info.values():
+            info.line_count = 0
+
+        with open(self.filename, 'r') as f:
+            for atom in self._iter_acts(Play._stripped(f)):
+                yield atom
+
+    @staticmethod
+    def _stripped(f):
+        return (l.rstrip('\r\n') for l in f)
 
     # A compartmentalized method to read in the list of characters at the
     # beginning of the play. These names are not used directly in the atoms list
     # however they are useful still. For example, on parsing the stage notes
     # one must be able to tell if a potential character is actually a character.
-    def _parse_characters(self):
+    # Only as many lines as are needed are taken from lines, so it may be an
+    # iterator over a file that is still being read.
+    def _parse_characters(self, lines):
         self.characters = []
         self.character_info = {}
+        self.names = NameTable()
 
         header_found = False
-        for line in self.raw_lines:
+        for line in lines:
             # Once we've reached the character section, and there is a blank
             # line, the character section is over.
-            if header_found and not re.match(Play.PADDING, line):
+            if header_found and not Play._PADDING_RE.match(line):
                 if not line:
                     break
 
-                m = re.match(Play.CHARACTER_LISTING, line)
+                m = Play._CHARACTER_LISTING_RE.match(line)
                 name = m.group(1)
                 short = ''
                 desc = m.group(3)
@@ -78,13 +694,157 @@ class Play(object):
 
                 self.characters.append(Character(name, short, desc))
                 self.character_info[short or name] = CharacterInfo(0)
+                self.names.intern(short or name)
 
             if not header_found:
                 header_found = line == Play.CHARACTERS_SECTION_HEADER
 
+        self._index_characters()
+
     # A compartmentalized method to initialize reading the acts of the play
     # after all the introductory information.
-    def _parse_acts(self):
+    def _parse_acts(self, workers=1):
+        self.atoms.extend(self._iter_acts_with(workers))
+
+    def _iter_acts_with(self, workers):
+        if workers > 1:
+            return self._iter_parallel_acts(self.raw_lines, workers)
+
+        return self._iter_acts(self.raw_lines)
+
+    # Parses the acts in a pool of worker processes and yields the atoms in
+    # order, the same as _iter_acts does. The lines are split at the act
+    # headers, and each part is parsed as if it started a new play, from scene
+    # 0 with no stage note open and no one on stage. Then the atoms of the
+    # parts are put together here in order, and the line counts of the parts
+    # are added up.
+    #
+    # If an act has content lines before its first scene header, or starts in
+    # the middle of a stage note, then its atoms do depend on where the act
+    # before it ended. Such an act is parsed again here once that is known.
+    #
+    # The audience of a part only depends on the act before it if someone is
+    # still on stage when the part starts, or if the stage notes at the end of
+    # the act before it were not applied yet. Then the stage notes of the part
+    # are applied here, to the audience the act before it ended with, only
+    # until the audience is the same as the one the part was parsed with. From
+    # there on it is the same all the way through the part, since each
+    # audience only depends on the one before it and the stage notes between.
+    def _iter_parallel_acts(self, lines, workers):
+        starts = [0]
+        for i, line in enumerate(lines):
+            if i > 0 and line.startswith('ACT '):
+                m = Play._LINE_SCANNER_RE.match(line)
+                if m and m.lastgroup == 'act':
+                    starts.append(i)
+        parts = [lines[start:end] for start, end in zip(starts, starts[1:] + [len(lines)])]
+
+        base = len(self.names.names)
+        aud = set()
+        audience = Audience(self.names)
+        last_stage_notes = []
+        state = _act_start_state()
+
+        pool = multiprocessing.Pool(workers, _init_act_worker, (self.characters,))
+        try:
+            results = pool.imap(_parse_act_part, parts)
+            for part, result in izip(parts, results):
+                columns, changes, names, line_counts, end_state, starts_with_scene = result
+                if state['multiline_stage_note'] or (
+                        not starts_with_scene and state != _act_start_state()):
+                    changes = []
+                    columns = _flatten_atoms(self._iter_acts(part, state, changes))
+                    names = self.names.names[base:]
+                else:
+                    for name, n in line_counts.items():
+                        self.character_info[name].line_count += n
+                    state = end_state
+
+                # The masks of the part are over the names of the worker, which
+                # only agree with those of the play on the listed characters.
+                changes = dict((key, self._translate_mask(mask, base, names))
+                               for key, mask in changes)
+
+                same = not aud and not last_stage_notes
+                part_mask = 0
+
+                # The atoms are built straight from their fields, which is
+                # quicker than through the constructors of the namedtuples.
+                kinds, acts, scenes, nums, text, people, persons = columns
+                for kind, act, scene, num, content, person in izip(
+                        kinds, acts, scenes, nums, text.split('\n'), people):
+                    if kind == 'S':
+                        atom = tuple.__new__(StageNote, (act, scene, num, content,
+                                                         persons[person]))
+                        last_stage_notes.append(atom)
+                    else:
+                        if last_stage_notes:
+                            part_mask = changes.get((scene, num), part_mask)
+                            if same:
+                                mask = part_mask
+                            else:
+                                self._update_audience_from_stage_notes(aud, last_stage_notes)
+                                mask = self.names.mask(aud)
+                                same = mask == part_mask
+                            del last_stage_notes[:]
+
+                            if mask != audience.mask:
+                                audience = Audience(self.names, mask)
+
+                        if kind == 'L':
+                            atom = tuple.__new__(Line, (act, scene, num, content,
+                                                        persons[person], audience))
+                        else:
+                            atom = tuple.__new__(Annotation, (act, scene, num, content))
+
+                    yield atom
+
+                if same:
+                    aud = set(self.names.names_of(part_mask))
+        finally:
+            pool.close()
+            pool.join()
+
+    # Returns the mask over the names of the play of a mask over base names of
+    # the play followed by the given names.
+    def _translate_mask(self, mask, base, names):
+        translated = mask & ((1 << base) - 1)
+        mask >>= base
+        for name in names:
+            if not mask:
+                break
+            if mask & 1:
+                translated |= 1 << self.names.intern(name)
+            mask >>= 1
+
+        return translated
+
+    # Returns whether the lines of an act get to a scene header before any
+    # content line, so that its atoms do not depend on the scene and line
+    # number that the act before it ended in.
+    @staticmethod
+    def _starts_with_scene(lines):
+        for line in lines:
+            m = Play._LINE_SCANNER_RE.match(line)
+            if not m:
+                return False
+            if m.lastgroup == 'scene':
+                return True
+
+        return True
+
+    # Parses the acts from the given lines of the play and yields the atoms in
+    # order. Lines before the first act are passed over, so the lines can start
+    # from the beginning of the file.
+    #
+    # The lines may also be a part of the play that starts at an act header,
+    # which is how acts are parsed in parallel. Then state is a dict of the
+    # scene, line_num and multiline_stage_note that the part starts in, and it
+    # is updated to those the part ends in. If audience_changes is given, then
+    # each time stage notes are applied to the audience, the (scene, num) of
+    # the atom they are applied at and the mask of the audience after are
+    # added to it.
+    def _iter_acts(self, lines, state=None, audience_changes=None):
         act = 0
         scene = 0
         line_num = 1
@@ -93,63 +853,74 @@ class Play(object):
         multiline_stage_note = False
         last_stage_notes = []
 
+        if state is not None:
+            scene = state['scene']
+            line_num = state['line_num']
+            multiline_stage_note = state['multiline_stage_note']
+
         character = None
         aud = set()
+        audience = Audience(self.names)
 
-        for i, line in enumerate(self.raw_lines):
-            m = re.match(Play.ACT_HEADER, line)
-            if m:
-                act = int(m.group(1))
-                character = None
-                continue
+        # The number of lines that take each branch of the scanner is only
+        # counted when instrumenting, to keep the loop tight otherwise.
+        counting = instrument.enabled
+        branches = dict.fromkeys(['act', 'scene', 'padding', 'blank', 'content'], 0)
 
-            m = re.match(Play.SCENE_HEADER, line)
+        scan = Play._LINE_SCANNER_RE.match
+        for i, line in enumerate(lines):
+            m = scan(line)
             if m:
-                scene = int(m.group(1))
-                line_num = 1
-                character = None
-                continue
+                kind = m.lastgroup
+                if counting:
+                    branches[kind] += 1
+                if kind == 'act':
+                    act = int(m.group('act'))
+                    character = None
+                elif kind == 'scene':
+                    scene = int(m.group('scene'))
+                    line_num = 1
+                    character = None
+                elif kind == 'blank':
+                    # If the line is a blank line, then keep track of it and
+                    # there's nothing else for us to do.
+                    last_blank_or_ann = i
 
-            # Do not bother if the line is a padded line.
-            if re.match(Play.PADDING, line):
-                continue
-
-            # If the line is a blank line, then keep track of it and there's
-            # nothing else for us to do.
-            if not line:
-                last_blank_or_ann = i
+                # Padded lines are simply skipped.
                 continue
 
             # A line for the act and for the scene has been found and this
             # line is not a padding line or a blank line, so it is a content
             # line to be added.
+            if counting:
+                branches['content'] += 1
+
             if act >= 1 and scene >= 1:
                 # If the last line was a blank, then a character name
                 # might be on this line.
                 start_index = 0
                 if i - 1 == last_blank_or_ann:
-                    m = re.match(Play.CHARACTER, line)
+                    m = Play._CHARACTER_RE.match(line)
                     if m:
                         character = m.group(1)
                         start_index = m.end()
 
                 line = line[start_index:]
 
+                # Every stage note pattern needs a bracket, so most dialogue
+                # can skip the search entirely.
                 stage_note = None
-                m = re.search(Play.STAGE_NOTES, line)
+                m = None
+                if '[' in line or ']' in line:
+                    m = Play._STAGE_NOTES_RE.search(line)
                 if m:
                     if m.group(1):
                         stage_note = StageNote(act, scene, line_num, m.group(1), character)
-                        self.atoms.append(stage_note)
                     elif m.group(2):
                         stage_note = StageNote(act, scene, line_num, m.group(2), character)
-                        self.atoms.append(stage_note)
-
                         multiline_stage_note = True
                     elif m.group(3):
                         stage_note = StageNote(act, scene, line_num, m.group(3), character)
-                        self.atoms.append(stage_note)
-
                         multiline_stage_note = False
 
                     line = line[:m.start()] + line[m.end():]
@@ -160,10 +931,10 @@ class Play(object):
                     # been opened but not closed yet. In this case this
                     # entire line is part of that stage note.
                     stage_note = StageNote(act, scene, line_num, line, character)
-                    self.atoms.append(stage_note)
                     line = ''
 
                 if stage_note:
+                    yield stage_note
                     last_stage_notes.append(stage_note)
 
                 # If there is no more line, then it was all stage notes, so
@@ -173,18 +944,27 @@ class Play(object):
                         self._update_audience_from_stage_notes(aud, last_stage_notes)
                         del last_stage_notes[:]
 
+                        # Lines keep sharing the last Audience until the stage
+                        # notes actually change who is on stage.
+                        mask = self.names.mask(aud)
+                        if mask != audience.mask:
+                            audience = Audience(self.names, mask)
+                        if audience_changes is not None:
+                            audience_changes.append(((scene, line_num), mask))
+
                     # Check if there are annotations on this line, in which case
                     # it is the only thing on the line and we do not have to
                     # look for dialogue.
-                    m = re.match(Play.ANNOTATION, line)
+                    m = None
+                    if line[0] == '{':
+                        m = Play._ANNOTATION_RE.match(line)
                     if m:
                         a = Annotation(act, scene, line_num, m.group(1))
-                        self.atoms.append(a)
                         line_num += 1
                         last_blank_or_ann = i
+                        yield a
                     else:
-                        l = Line(act, scene, line_num, line, character, aud.copy())
-                        self.atoms.append(l)
+                        l = Line(act, scene, line_num, line, character, audience)
                         try:
                             self.character_info[character].line_count += 1
                         except KeyError:
@@ -194,12 +974,22 @@ class Play(object):
                             pass
 
                         line_num += 1
+                        yield l
                 else:
                     # The line originally had content, but it was removed by
                     # stage notes. So that means that all the content was in
                     # stage notes, so that is a new line.
                     line_num += 1
 
+        if counting:
+            for kind, n in branches.items():
+                instrument.count('play.lines.' + kind, n)
+
+        if state is not None:
+            state['scene'] = scene
+            state['line_num'] = line_num
+            state['multiline_stage_note'] = multiline_stage_note
+
     # Updates the given audience from the stage_note and last character's line.
     # Audience should be a set and stage_notes a list of StageNote tuples.
     # Essentially, ENTER_VERBS and EXIT_VERBS are looked for by sentence, and
@@ -208,62 +998,144 @@ class Play(object):
     # is to account for multiline stage notes which are parsed into several
     # different PlayAtoms.
     def _update_audience_from_stage_notes(self, audience, stage_notes):
-        content = reduce(lambda c, sn: c + sn.content, stage_notes, '')
-        last_c = stage_notes[0].context
+        instrument.count('play.stage_notes', len(stage_notes))
+
+        content = ''.join(sn.content for sn in stage_notes)
 
         # Enter and exit instructions come in a sentence at a time. That is the
         # assumption at least.
         for s in content.upper().split('.'):
-            verb_type = 0
-
             # Search for enter type verbs and keep track of where it happens
-            # in the sentence. Assume that only one of these verbs occurs per
-            # sentence.
-            f_verb = reduce(lambda f, v:
-                            v if v in s and (not f or len(v) > len(f)) else f,
-                            Play.ENTER_VERBS, None)
-            if f_verb:
-                verb_type = 1
-                idx = s.index(f_verb)
-            else:
-                # Same thing as above but for exit type verbs.
-                f_verb = reduce(lambda f, v:
-                                v if v in s and (not f or len(v) > len(f)) else f,
-                                Play.EXIT_VERBS, None)
-                if f_verb:
-                    verb_type = 2
-                    idx = s.index(f_verb)
+            # in the sentence, and if there are none, then exit type verbs.
+            # Assume that only one of these verbs occurs per sentence.
+            verb_type, f_verb, idx = Play._find_verb(s)
 
             if verb_type != 0:
-                s = (s[:idx] + s[idx + len(f_verb):]).strip()
-                conjuncts = re.split(Play.CONJUNCTIONS, s)
+                s = s[:idx] + s[idx + len(f_verb):]
                 p_characters = set()
 
+                # Commas and whitespace are the only word breaks. AND after a
+                # comma is never a name, so it can be passed over like any
+                # other word.
                 neg = False
-                for p_character in conjuncts:
-                    for word in p_character.split():
-                        if self._exists_character(word):
-                            # If there was a negative word, it means the
-                            # character is not a operand of the ENTER or EXIT
-                            # operation.
-                            if not neg:
-                                p_characters.add(word)
-                            else:
-                                p_characters.remove(word)
-                        elif word in Play.SING_PRONOUNS:
-                            p_characters.add(stage_notes[0].context)
-                        elif word in Play.PLURAL_PRONOUNS:
-                            p_characters |= audience
-                        elif word in Play.NEG_MODIFIERS:
-                            neg = True
+                for word in Play._WORD_RE.findall(s):
+                    if word in self._character_words:
+                        # If there was a negative word, it means the
+                        # character is not a operand of the ENTER or EXIT
+                        # operation.
+                        if not neg:
+                            p_characters.add(word)
+                        else:
+                            p_characters.remove(word)
+                    elif word in Play._SING_PRONOUNS:
+                        p_characters.add(stage_notes[0].context)
+                    elif word in Play._PLURAL_PRONOUNS:
+                        p_characters |= audience
+                    elif word in Play._NEG_MODIFIERS:
+                        neg = True
 
                 if verb_type == 1:
                     audience |= p_characters
                 elif verb_type == 2:
                     audience -= p_characters
 
+    # Returns (verb type, verb, index) for the verb of the uppercase sentence,
+    # where the verb type is 1 for an enter verb, 2 for an exit verb, or 0 if
+    # there is neither. The longest verb found of a type wins, and enter verbs
+    # are preferred over exit verbs.
+    @staticmethod
+    def _find_verb(s):
+        for verb_type, verbs in ((1, Play._ENTER_VERBS_BY_LENGTH),
+                                 (2, Play._EXIT_VERBS_BY_LENGTH)):
+            for verb in verbs:
+                idx = s.find(verb)
+                if idx >= 0:
+                    return verb_type, verb, idx
+
+        return 0, None, -1
+
     def _exists_character(self, p_name):
-        u = p_name.upper()
-        return reduce(lambda flag, c:
-                      flag or u == c.name or u == c.short,
-                      self.characters, False)
+        return p_name.upper() in self._character_words
+
+    # Builds the set of names that stage notes can refer to the characters by,
+    # which is each character's full name and short name. Stage notes are
+    # compared in uppercase, so only names listed in uppercase can match.
+    def _index_characters(self):
+        words = set()
+        for c in self.characters:
+            words.add(c.name)
+            if c.short:
+                words.add(c.short)
+
+        self._character_words = frozenset(words)
+
+# The state that _iter_parallel_acts parses each act in.
+def _act_start_state():
+    return {'scene': 0, 'line_num': 1, 'multiline_stage_note': False}
+
+# The play that a worker process of _iter_parallel_acts parses its parts with,
+# which only has the characters of the play, and the number of names in its
+# NameTable before any part is parsed.
+_act_play = None
+_act_base = 0
+
+def _init_act_worker(characters):
+    global _act_play, _act_base
+
+    character_info = dict((c.short or c.name, CharacterInfo(0)) for c in characters)
+    _act_play = Play.from_parts(None, None, characters, character_info, [])
+    _act_base = len(_act_play.names.names)
+
+# Parses a part of the play that starts at an act header in a worker process.
+# Returns the columns of the atoms, as from _flatten_atoms, the audience
+# changes of the part, as from _iter_acts, the names that the masks
+# of those use beyond the listed characters, the line counts of the characters
+# in the part, the state that the part ends in, and whether it starts with a
+# scene.
+def _parse_act_part(lines):
+    play = _act_play
+    for info in play.character_info.values():
+        info.line_count = 0
+
+    state = _act_start_state()
+    changes = []
+    columns = _flatten_atoms(play._iter_acts(lines, state, changes))
+    line_counts = dict((name, info.line_count)
+                       for name, info in play.character_info.items() if info.line_count)
+
+    return (columns, changes, play.names.names[_act_base:], line_counts, state,
+            Play._starts_with_scene(lines))
+
+# Returns the atoms as columns, which are much quicker to send between processes
+# than the atoms themselves. The columns are a string with a letter for the
+# kind of each atom, S, L or A, arrays of the acts, scenes and numbers, the
+# contents joined with newlines, which no content has, and an array of the
+# speaker or context of each atom as an index into a list of those, which
+# comes last. The audiences of Lines are left out.
+def _flatten_atoms(atoms):
+    kinds = []
+    acts = array('H')
+    scenes = array('H')
+    nums = array('i')
+    contents = []
+    people = array('i')
+    ids = {}
+    persons = []
+    for atom in atoms:
+        if isinstance(atom, Line):
+            kinds.append('L')
+            person = atom.speaker
+        elif isinstance(atom, StageNote):
+            kinds.append('S')
+            person = atom.context
+        else:
+            kinds.append('A')
+            person = None
+
+        acts.append(atom.act)
+        scenes.append(atom.scene)
+        nums.append(atom.num)
+        contents.append(atom.content)
+        people.append(_intern(ids, persons, person))
+
+    return ''.join(kinds), acts, scenes, nums, '\n'.join(contents), people, persons
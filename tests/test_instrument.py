@@ -0,0 +1,31 @@
+import time
+
+from nose.tools import assert_equal, assert_true
+
+import instrument
+
+def setup_module():
+    instrument.enable()
+
+def teardown_module():
+    instrument.disable()
+    instrument.reset()
+
+def slow(items, delay):
+    for item in items:
+        time.sleep(delay)
+        yield item
+
+# The stage before a timed stream, and the consumer after it, are both slow,
+# but only the stream's own work is timed.
+def test_timed_stream_leaves_out_other_stages():
+    stream = instrument.timed_stream('stage', lambda items: slow(items, 0.01),
+                                     slow(range(5), 0.02))
+    results = []
+    for item in stream:
+        time.sleep(0.02)
+        results.append(item)
+
+    seconds = instrument.report()['timers']['stage']['seconds']
+    assert_equal(results, range(5))
+    assert_true(0.04 <= seconds < 0.1, seconds)
@@ -0,0 +1,51 @@
+import os
+
+from nose.tools import assert_equal, assert_raises
+
+import playcache
+import shakespeare
+
+from tests import util
+
+directory = None
+play_filename = None
+
+def setup_module():
+    global directory, play_filename
+
+    directory, play_filename, _ = util.make_play()
+
+def teardown_module():
+    util.remove(directory)
+
+def cache_dir(name):
+    return os.path.join(directory, name)
+
+def entry_path(cache_dir):
+    return os.path.join(cache_dir, playcache.cache_key(play_filename) + '.play')
+
+def test_round_trip():
+    expected = shakespeare.Play(play_filename)
+    playcache.load_play(play_filename, cache_dir('round_trip'))
+    play = playcache.load_play(play_filename, cache_dir('round_trip'))
+
+    assert_equal(play.title, expected.title)
+    assert_equal(play.atoms, expected.atoms)
+
+# A damaged entry is not read as a play, and load_play parses the play again
+# and writes the entry over.
+def test_damaged_entry():
+    expected = shakespeare.Play(play_filename).atoms
+    path = entry_path(cache_dir('damaged'))
+    playcache.load_play(play_filename, cache_dir('damaged'))
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    for size in (5, len(data) // 2, len(data) - 1):
+        with open(path, 'wb') as f:
+            f.write(data[:size])
+
+        assert_raises(ValueError, playcache.read_play, path, play_filename)
+        assert_equal(playcache.load_play(play_filename, cache_dir('damaged')).atoms,
+                     expected)
+        assert_equal(os.path.getsize(path), len(data))
@@ -0,0 +1,60 @@
+import os
+import tempfile
+
+import numpy
+from nose.tools import assert_equal, assert_false, assert_is_none, assert_true
+
+from matching import DyadGraph
+from runstate import RunState
+
+from tests import util
+
+NAMES = ['LEAR', 'KENT', 'FOOL', 'EDGAR']
+
+directory = None
+
+def setup_module():
+    global directory
+
+    directory = tempfile.mkdtemp()
+
+def teardown_module():
+    util.remove(directory)
+
+def saved_state(name, non_hostile_dyads):
+    path = os.path.join(directory, name + '.run')
+    state = RunState(path)
+    state.set_non_hostile_dyads(non_hostile_dyads)
+    state.save()
+
+    return RunState(path)
+
+def test_samples_are_maximal():
+    graph = DyadGraph(NAMES, [('LEAR', 'KENT')])
+    rng = numpy.random.RandomState(0)
+    for _ in range(20):
+        assert_true(graph.is_maximal_matching(graph.sample(rng)))
+
+    assert_false(graph.is_maximal_matching([('LEAR', 'KENT')]))
+    assert_false(graph.is_maximal_matching([('LEAR', 'FOOL'), ('FOOL', 'EDGAR')]))
+    assert_false(graph.is_maximal_matching([('LEAR', 'GLOUCESTER')]))
+
+def test_unchanged_key_keeps_dyads():
+    graph = DyadGraph(NAMES, [('LEAR', 'KENT')])
+    state = saved_state('unchanged', [('FOOL', 'EDGAR')])
+
+    assert_equal(state.non_hostile_dyads(graph), [('FOOL', 'EDGAR')])
+
+def test_new_hostile_dyad_redraws():
+    graph = DyadGraph(NAMES, [('LEAR', 'KENT'), ('EDGAR', 'FOOL')])
+    state = saved_state('new_hostile', [('FOOL', 'EDGAR')])
+
+    assert_is_none(state.non_hostile_dyads(graph))
+
+# LEAR and KENT were both left over because they were hostile. Once the key no
+# longer has them, they could be paired, so the old dyads are not maximal.
+def test_dropped_hostile_dyad_redraws():
+    graph = DyadGraph(NAMES)
+    state = saved_state('dropped_hostile', [('FOOL', 'EDGAR')])
+
+    assert_is_none(state.non_hostile_dyads(graph))
@@ -0,0 +1,94 @@
+import os
+
+import numpy
+from nose.tools import assert_equal, assert_true
+
+import analysis
+from corenlp import CoreNLPClient
+import dyads
+import fakecorenlp
+import pipeline
+import shakespeare
+
+from tests import util
+
+server = None
+directory = None
+play = None
+hostile = None
+non_hostile = None
+
+def setup_module():
+    global server, directory, play, hostile, non_hostile
+
+    server = fakecorenlp.start()
+    directory, play_filename, key_filename = util.make_play()
+    play = shakespeare.Play(play_filename)
+    hostile = dyads.read_annotation_key(key_filename)
+    non_hostile = dyads.choose_non_hostile_dyads(play, hostile,
+                                                 numpy.random.RandomState(0))
+
+def teardown_module():
+    server.shutdown()
+    server.server_close()
+    util.remove(directory)
+
+def make_cache(name):
+    return analysis.SentimentCache(os.path.join(directory, name + '.sqlite'))
+
+def lines():
+    return [atom.content for atom in play.atoms if isinstance(atom, shakespeare.Line)]
+
+def stream_scores(nlp, units, cache):
+    scores = [None] * len(units)
+    for _, i, unit_scores in analysis.sentiment_stream(nlp, ((0, u) for u in units),
+                                                       cache=cache):
+        scores[i] = unit_scores
+
+    return scores
+
+def test_stream_matches_batch():
+    positions = dyads.collect_dyad_positions(play, hostile, non_hostile)
+    batch = dyads.analyze_groups(play, positions, CoreNLPClient(server.url),
+                                 make_cache('batch'), num_samples=200, seed=3,
+                                 workers=1)
+    stream = pipeline.analyze_stream(play.iter_atoms(), hostile, non_hostile,
+                                     CoreNLPClient(server.url), make_cache('stream'),
+                                     num_samples=200, seed=3, workers=1)
+
+    assert_true(any(group.sentences for group in batch))
+    assert_equal(batch, stream)
+
+def test_warm_cache_makes_no_requests():
+    units = lines()
+    nlp = CoreNLPClient(server.url)
+    cold = analysis.sentiment_units(nlp, units, cache=make_cache('warm'))
+
+    requests = server.requests
+    cache = make_cache('warm')
+    assert_equal(analysis.sentiment_units(nlp, units, cache=cache), cold)
+    assert_equal(stream_scores(nlp, units, cache), cold)
+    assert_equal(server.requests, requests)
+    assert_equal(cache.misses, 0)
+
+# Many lines end partway through a sentence, so runs of them are cached
+# together, and with small chunks plenty of those runs cross from one chunk of
+# the stream into the next.
+def test_runs_across_chunks():
+    units = lines()
+    assert_true(any(not u.rstrip().endswith(('.', '!', '?')) for u in units))
+
+    chunk_size = analysis.SentimentCache.QUERY_CHUNK_SIZE
+    analysis.SentimentCache.QUERY_CHUNK_SIZE = 7
+    try:
+        nlp = CoreNLPClient(server.url)
+        expected = analysis.sentiment_units(nlp, units)
+        assert_equal(stream_scores(nlp, units, make_cache('chunks')), expected)
+
+        requests = server.requests
+        cache = make_cache('chunks')
+        assert_equal(stream_scores(nlp, units, cache), expected)
+        assert_equal(server.requests, requests)
+        assert_equal(cache.misses, 0)
+    finally:
+        analysis.SentimentCache.QUERY_CHUNK_SIZE = chunk_size
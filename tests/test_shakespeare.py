@@ -0,0 +1,35 @@
+from nose.tools import assert_equal
+
+import benchmark
+import shakespeare
+
+from tests import util
+
+directory = None
+play_filename = None
+
+def setup_module():
+    global directory, play_filename
+
+    directory, play_filename, _ = util.make_play()
+
+def teardown_module():
+    util.remove(directory)
+
+def test_parse_matches_legacy_parser():
+    play = shakespeare.Play(play_filename)
+    expected = list(play.atoms)
+    counts = dict((name, info.line_count) for name, info in play.character_info.items())
+
+    benchmark.legacy_parse_acts(play)
+    assert_equal(play.atoms, expected)
+    assert_equal(dict((name, info.line_count)
+                      for name, info in play.character_info.items()), counts)
+
+def test_parallel_parse_matches():
+    expected = shakespeare.Play(play_filename).atoms
+    assert_equal(shakespeare.Play(play_filename, workers=2).atoms, expected)
+
+def test_lazy_parse_matches():
+    expected = shakespeare.Play(play_filename).atoms
+    assert_equal(list(shakespeare.Play(play_filename, lazy=True).iter_atoms()), expected)
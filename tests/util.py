@@ -0,0 +1,28 @@
+################################################################################
+#
+# Helpers shared by the tests. The tests run against small plays from playgen,
+# and score sentiment through the fake CoreNLP server of fakecorenlp, so they
+# need neither the Folger texts nor Java.
+#
+################################################################################
+
+import os
+import shutil
+import tempfile
+
+import playgen
+
+# A play small enough that the whole suite runs in a few seconds, with enough
+# speeches and stage notes that every kind of atom shows up.
+SMALL_PLAY = playgen.PlaySpec('Test Play', 2, 3, 25, 6, 12, 3, 0.3)
+
+# Makes a temporary directory and generates a small play in it. Returns the
+# directory and the filenames of the play and of its annotation key.
+def make_play(spec=SMALL_PLAY, seed=0):
+    directory = tempfile.mkdtemp()
+    filenames = playgen.generate(os.path.join(directory, 'play.txt'), spec, seed)
+
+    return (directory,) + filenames
+
+def remove(directory):
+    shutil.rmtree(directory, ignore_errors=True)